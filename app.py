@@ -1,12 +1,24 @@
-from flask import Flask, jsonify, render_template, request
-import json, time, os
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
+import gzip, json, os
 import scanner
-from datetime import datetime, timedelta
+from datetime import datetime
 from dotenv import load_dotenv
 import logging
-from sqlalchemy import func, desc
-from models import Device, DeviceStatus, DeviceHistory, Network, ScanLog, get_db_session, init_db
+from models import Device, get_db_session, init_db
+import db_writer
+import history_log
+import history_query
 import network_scanner
+import presence_heatmap
+import presence_rollups
+import presence_events
+import presence_snapshot
+import presence_state
+import probe_schedule
+import probe_strategy
+import retention
+import scan_pool
+import rtt_estimator
 
 # 加载环境变量
 load_dotenv()
@@ -20,23 +32,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger('app')
 
-# 初始化数据库
-init_db()
-
 # 初始化Flask应用
 app = Flask(__name__)
 
-# 初始化网络配置并启动扫描
-network_scanner.init_networks()
-network_scanner.start_scan_loop(interval=int(os.environ.get('SCAN_INTERVAL', 30)))
+_background_started = False
 
-# 兼容旧版本，保留旧的扫描器
-scanner.start_loop(interval=60)  # 降低旧扫描器频率
+# 初始化数据库并启动后台任务（网段调度、历史数据清理、旧版 JSON 兼容），只执行一次
+# 由 `python app.py` 或 WSGI 入口 wsgi.py 调用；不能放在模块顶层：探测子进程(scan_pool)
+# 以 forkserver/spawn 启动时会重新导入主模块，顶层代码会在每个子进程里再执行一遍
+def start_background():
+    global _background_started
+    if _background_started or scan_pool.in_worker():
+        return
+    _background_started = True
+    
+    init_db()
+    
+    # 启动时检测一次探测后端（ICMP 套接字 / 系统 ping），结果缓存供两个扫描器共用
+    probe_strategy.detect_backend()
+    
+    # 初始化网络配置并启动扫描
+    network_scanner.init_networks()
+    network_scanner.start_scheduler(interval=int(os.environ.get('SCAN_INTERVAL', 30)))
+    # 历史数据按自己的间隔分批清理，不依赖扫描时机
+    retention.start()
+    
+    # 兼容旧版本：默认由扫描结果快照导出旧版 JSON 文件，每个主机每轮只探测一次
+    scanner.start_compat(interval=60)
 
 # 文件路径常量
 DEVICES_FILE = "devices.json"
 STATUS_FILE  = scanner.STATUS_FILE
-HISTORY_FILE = scanner.HISTORY_FILE
 
 def load_json(path, default=None):
     try:
@@ -59,143 +85,40 @@ def device_detail(ip):
 
 @app.route("/api/status")
 def api_status():
-    session = get_db_session()
-    now_ts = time.time()
-    now_str = time.strftime("%Y-%m-%d %H:%M:%S")
-    
+    # 直接返回扫描线程发布的内存快照，只有冷启动时才查询数据库
     try:
-        # 获取所有设备
-        devices = session.query(Device).all()
-        
-        # 获取在线设备
-        online_devices = session.query(Device).join(DeviceStatus).filter(DeviceStatus.is_online == True).all()
-        
-        # 获取最后一次扫描时间
-        last_scan = session.query(func.max(ScanLog.timestamp)).scalar()
-        if last_scan:
-            last_update = last_scan.strftime("%Y-%m-%d %H:%M:%S")
-        else:
-            last_update = now_str
-        
-        # 准备返回数据
-        online = {}
-        offline = {}
-        
-        # 统计信息
-        stats = {
-            "total": len(devices),
-            "online": len(online_devices),
-            "offline": len(devices) - len(online_devices),
-            "types": {}
-        }
-        
-        # 按类型统计
-        type_counts = {}
-        for device in devices:
-            dtype = device.type or "未分类"
-            if dtype not in type_counts:
-                type_counts[dtype] = {"total": 0, "online": 0}
-            type_counts[dtype]["total"] += 1
-        
-        # 按类型统计在线设备
-        for device in online_devices:
-            dtype = device.type or "未分类"
-            if dtype in type_counts:
-                type_counts[dtype]["online"] += 1
-        
-        # 计算每种类型的在线率
-        for dtype, counts in type_counts.items():
-            if counts["total"] > 0:
-                counts["online_rate"] = round((counts["online"] / counts["total"]) * 100, 1)
-            else:
-                counts["online_rate"] = 0
-        
-        stats["types"] = type_counts
-        
-        # 计算总在线率
-        if stats["total"] > 0:
-            stats["online_rate"] = round((stats["online"] / stats["total"]) * 100, 1)
-        else:
-            stats["online_rate"] = 0
-        
-        # 处理每个设备的详细信息
-        for device in devices:
-            status = device.status
-            ip = device.ip
-            name = device.name or ""
-            remark = device.remark or ""
-            dtype = device.type or "未分类"
-            
-            if status and status.is_online:
-                # 设备在线
-                try:
-                    # 计算在线时长
-                    last_seen = status.last_seen
-                    start_time = status.start_time or last_seen
-                    
-                    delta = int(now_ts - start_time.timestamp())
-                    h, rem = divmod(delta, 3600)
-                    m, s = divmod(rem, 60)
-                    duration = f"{h:02d}:{m:02d}:{s:02d}"
-                    
-                    # 计算最后一次检测的时间差（分钟）
-                    last_check_mins = int((now_ts - last_seen.timestamp()) / 60)
-                    
-                    online[ip] = {
-                        "name": name,
-                        "remark": remark,
-                        "type": dtype,
-                        "last_seen": last_seen.strftime("%Y-%m-%d %H:%M:%S"),
-                        "last_check_mins": last_check_mins,
-                        "duration": duration,
-                        "start_time": start_time.strftime("%Y-%m-%d %H:%M:%S"),
-                        "response_time": status.response_time
-                    }
-                except Exception as e:
-                    logger.error(f"处理设备 {ip} 时间数据出错: {str(e)}")
-                    offline[ip] = {"name": name, "remark": remark, "type": dtype, "error": "时间数据格式错误"}
-            else:
-                # 设备离线
-                offline[ip] = {"name": name, "remark": remark, "type": dtype}
-        
-        # 添加网段信息
-        networks = session.query(Network).all()
-        network_info = []
-        for network in networks:
-            network_info.append({
-                "id": network.id,
-                "name": network.name,
-                "cidr": network.cidr,
-                "is_active": network.is_active,
-                "scan_interval": network.scan_interval,
-                "last_scan": network.last_scan.strftime("%Y-%m-%d %H:%M:%S") if network.last_scan else None
-            })
-        
-        return jsonify({
-            "online": online,
-            "offline": offline,
-            "stats": stats,
-            "networks": network_info,
-            "now": now_str,
-            "server_time": now_str,
-            "last_update": last_update
-        })
-    
+        snapshot = presence_snapshot.get()
     except Exception as e:
         logger.error(f"获取状态信息失败: {str(e)}")
         return jsonify({"error": str(e)}), 500
     
-    finally:
-        session.close()
+    response = Response(snapshot.body, mimetype="application/json")
+    response.set_etag(snapshot.etag)
+    # 浏览器每次都带 If-None-Match 回源校验，快照未变时返回 304
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+@app.route("/api/stream")
+def api_stream():
+    # SSE：只推送上线/离线/响应时间/设备信息变化，断线重连时按 Last-Event-ID 补发
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    response = Response(
+        stream_with_context(presence_events.stream(last_event_id)),
+        mimetype="text/event-stream"
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # 关闭 nginx 缓冲
+    return response
 
 @app.route("/api/scan", methods=["POST"])
 def api_scan():
     try:
-        # 使用新的网段扫描器
+        # 立即扫描所有启用的网段（与定时调度共用扫描线程池），扫描完成后返回最新状态
         network_scanner.scan_all_networks()
         
-        # 兼容旧版本
-        scanner.check_online_devices()
+        # 兼容旧版本（仅在保留旧扫描器时单独扫描，快照导出模式下已随快照更新）
+        if scanner.LEGACY_JSON_MODE == "scanner":
+            scanner.check_online_devices()
         
         return api_status()
     except Exception as e:
@@ -210,8 +133,8 @@ def api_device():
     if not ip:
         return jsonify({"success": False, "error": "缺少IP参数"}), 400
     
-    session = get_db_session()
-    try:
+    # 数据库写入交给单写线程，与扫描写入排队执行，不会因为抢写锁而失败
+    def update_device(session):
         # 查找设备
         device = session.query(Device).filter_by(ip=ip).first()
         
@@ -229,13 +152,13 @@ def api_device():
                     first_seen=datetime.now()
                 )
                 session.add(device)
-                session.commit()
+                session.flush()
                 logger.info(f"从旧文件导入设备: {ip}")
             else:
                 # 创建新设备
                 device = Device(ip=ip, first_seen=datetime.now())
                 session.add(device)
-                session.commit()
+                session.flush()
                 logger.info(f"创建新设备: {ip}")
         
         # 动态修改
@@ -245,10 +168,24 @@ def api_device():
                 setattr(device, field, data[field])
                 modified = True
         
-        if modified:
-            device.last_modified = datetime.now()
-            session.commit()
+        if not modified:
+            return None
+        device.last_modified = datetime.now()
+        return {
+            "ip": ip,
+            "name": device.name or "",
+            "remark": device.remark or "",
+            "type": device.type or "未分类"
+        }
+    
+    try:
+        updated = db_writer.run(update_device)
+        
+        if updated:
             logger.info(f"更新设备信息: {ip}")
+            # 名称/备注/类型变化需要立即体现在状态快照和事件流中
+            presence_snapshot.publish_quietly()
+            presence_events.emit("device", updated)
         
         # 同时更新旧文件以保持兼容性
         try:
@@ -267,71 +204,175 @@ def api_device():
         return jsonify({"success": True})
     
     except Exception as e:
-        session.rollback()
         logger.error(f"更新设备信息失败: {str(e)}")
         return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/api/heatmap/<ip>")
+def api_heatmap(ip):
+    # 每天 1440 分钟的在线位图；?days= 天数(或 ?period=daily|weekly|monthly)，?encoding=bits|rle
+    period_days = {"daily": 1, "weekly": 7, "monthly": 30}
+    try:
+        days = int(request.args.get("days") or period_days.get(request.args.get("period", "daily"), 1))
+    except ValueError:
+        return jsonify({"error": "days 必须是整数"}), 400
+    days = max(1, min(days, 366))
+    encoding = request.args.get("encoding", "bits")
+    if encoding not in ("bits", "rle"):
+        return jsonify({"error": f"不支持的编码: {encoding}"}), 400
     
+    session = get_db_session()
+    try:
+        device = session.query(Device.id).filter_by(ip=ip).first()
+        if not device:
+            return jsonify({"error": "设备不存在"}), 404
+        
+        matrix = presence_heatmap.load_matrix(session, device.id, days)
+        payload = {
+            "ip": ip,
+            "encoding": encoding,
+            "minutes": presence_heatmap.MINUTES_PER_DAY,
+            "dates": [day.strftime("%Y-%m-%d") for day, _ in matrix],
+            "online": [presence_heatmap.encode_day(bits, encoding) for _, bits in matrix]
+        }
+    except Exception as e:
+        logger.error(f"获取热力图失败: {str(e)}")
+        return jsonify({"error": str(e)}), 500
     finally:
         session.close()
+    
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    response = Response(body, mimetype="application/json")
+    if len(body) > 1024 and "gzip" in request.headers.get("Accept-Encoding", ""):
+        response.set_data(gzip.compress(body, compresslevel=5))
+        response.headers["Content-Encoding"] = "gzip"
+        response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+@app.route("/api/history", methods=["GET", "POST"])
+def api_history_bulk():
+    # 多设备历史：?ips=a,b（或 POST {"ips": [...]}）、?type=、?network=CIDR 筛选设备，
+    # ?period= 或 ?start=&end= 指定范围，?resolution= 指定粒度；一条查询，流式返回
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return jsonify({"error": "请求体必须是 JSON 对象"}), 400
+    body_ips = body.get("ips") or []
+    if not isinstance(body_ips, list) or not all(isinstance(ip, str) for ip in body_ips):
+        return jsonify({"error": "ips 必须是 IP 字符串列表"}), 400
+    args = request.values
+    ips = [ip.strip() for value in args.getlist("ips") + args.getlist("ip") for ip in value.split(",") if ip.strip()]
+    ips += [ip.strip() for ip in body_ips if ip.strip()]
+    device_type = args.get("type") or body.get("type")
+    network = args.get("network") or body.get("network")
+    
+    try:
+        start, end = history_query.resolve_range(
+            args.get("period") or body.get("period"),
+            args.get("start") or body.get("start"),
+            args.get("end") or body.get("end")
+        )
+    except ValueError as e:
+        return jsonify({"error": f"时间格式错误: {str(e)}"}), 400
+    if not ips and not device_type and not network:
+        return jsonify({"error": "需要指定 ips、type 或 network"}), 400
+    
+    session = get_db_session()
+    try:
+        devices = history_query.select_devices(session, ips, device_type, network)
+        resolution = args.get("resolution") or body.get("resolution") or presence_rollups.resolution_for_span(end - start)
+        if resolution not in ("raw",) + presence_rollups.RESOLUTIONS:
+            session.close()
+            return jsonify({"error": f"不支持的粒度: {resolution}"}), 400
+        resolution = history_query.effective_resolution(session, [device_id for device_id, _ in devices], resolution, start, end)
+    except Exception as e:
+        session.close()
+        logger.error(f"获取历史记录失败: {str(e)}")
+        return jsonify({"error": str(e)}), 400 if isinstance(e, ValueError) else 500
+    
+    def generate():
+        try:
+            yield from history_query.stream_timelines(session, devices, start, end, resolution)
+        except Exception as e:
+            logger.error(f"输出历史记录失败: {str(e)}")
+            raise
+        finally:
+            session.close()
+    
+    return Response(stream_with_context(generate()), mimetype="application/json")
 
 @app.route("/api/history/<ip>")
 def api_history(ip):
     period = request.args.get("period", "daily")
-    now = datetime.now()
+    # 输出格式：json 数组(默认) / ndjson / csv，均为流式输出
+    fmt = request.args.get("format", "json")
+    if fmt not in history_query.FORMATS:
+        return jsonify({"error": f"不支持的格式: {fmt}"}), 400
     
     # 确定时间范围
-    if period == "daily":
-        cutoff = now - timedelta(days=1)
-    elif period == "weekly":
-        cutoff = now - timedelta(weeks=1)
-    elif period == "monthly":
-        cutoff = now - timedelta(days=30)
-    else:
-        cutoff = now - timedelta(days=1)
+    try:
+        cutoff, end = history_query.resolve_range(period, request.args.get("start"), request.args.get("end"))
+    except ValueError as e:
+        return jsonify({"error": f"时间格式错误: {str(e)}"}), 400
     
     session = get_db_session()
     try:
         # 查找设备
-        device = session.query(Device).filter_by(ip=ip).first()
+        device = session.query(Device.id).filter_by(ip=ip).first()
         
         if not device:
+            session.close()
             # 如果数据库中不存在，尝试从旧文件中查找
-            old_history = load_json(HISTORY_FILE, [])
-            result = []
-            
-            for entry in old_history:
-                ts = datetime.strptime(entry["timestamp"], "%Y-%m-%d %H:%M:%S")
-                if ts >= cutoff:
-                    result.append({
-                        "timestamp": entry["timestamp"],
-                        "online": ip in entry["online"]
-                    })
-            
-            return jsonify(result)
-        
-        # 查询设备历史记录
-        history_records = session.query(DeviceHistory)\
-            .filter(DeviceHistory.device_id == device.id)\
-            .filter(DeviceHistory.timestamp >= cutoff)\
-            .order_by(DeviceHistory.timestamp)\
-            .all()
-        
-        result = []
-        for record in history_records:
-            result.append({
-                "timestamp": record.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                "online": record.is_online,
-                "response_time": record.response_time
-            })
+            # 按天分段的旧版历史记录，直接定位到截止时间读取
+            points = (
+                {"timestamp": entry["timestamp"], "online": ip in entry["online"]}
+                for entry in history_log.read_since(cutoff)
+            )
+            return Response(
+                stream_with_context(history_query.stream_points(points, fmt)),
+                mimetype=history_query.FORMATS[fmt]
+            )
         
-        return jsonify(result)
+        # 按时间段选择粒度：一天内用原始记录，更长的时间段读汇总表；可用 ?resolution= 覆盖
+        resolution = request.args.get("resolution") or presence_rollups.PERIOD_RESOLUTION.get(period, "raw")
+        if resolution not in ("raw",) + presence_rollups.RESOLUTIONS:
+            session.close()
+            return jsonify({"error": f"不支持的粒度: {resolution}"}), 400
+        # 汇总表还没有数据（刚升级且未补算）时退回原始记录；区间存储模式下由区间还原时间线
+        resolution = history_query.effective_resolution(session, [device.id], resolution, cutoff, end)
     
     except Exception as e:
+        session.close()
         logger.error(f"获取历史记录失败: {str(e)}")
         return jsonify({"error": str(e)}), 500
     
-    finally:
-        session.close()
+    # 游标分批读取并逐条编码输出，月度数据也不会一次性载入内存
+    def generate():
+        try:
+            points = (point for _, point in history_query.iter_points(session, [device.id], cutoff, end, resolution))
+            yield from history_query.stream_points(points, fmt)
+        except Exception as e:
+            logger.error(f"输出历史记录失败: {str(e)}")
+            raise
+        finally:
+            session.close()
+    
+    return Response(stream_with_context(generate()), mimetype=history_query.FORMATS[fmt])
+
+@app.route("/api/metrics")
+def api_metrics():
+    # 各探测后端的累计探测次数，subprocess 计数即 fork 的 ping 进程数
+    scheduler = network_scanner.get_scheduler()
+    return jsonify({
+        "probe": {
+            "backend": probe_strategy.detect_backend(),
+            "counters": probe_strategy.get_counters()
+        },
+        "scheduler": scheduler.stats() if scheduler else None,
+        "probe_schedule": probe_schedule.get_schedule().stats(),
+        "probe_timeouts": rtt_estimator.get_estimator().stats(),
+        "presence": presence_state.get_tracker().stats(),
+        "db_writer": db_writer.get_writer().stats() if db_writer.enabled() else None,
+        "retention": retention.get_worker().stats() if retention.get_worker() else None
+    })
 
 if __name__ == "__main__":
     # 初始化数据库
@@ -340,16 +381,12 @@ if __name__ == "__main__":
     # 导入旧数据
     try:
         network_scanner.import_legacy_data()
-        network_scanner.init_networks()
         logger.info("旧数据导入完成")
     except Exception as e:
         logger.error(f"旧数据导入失败: {str(e)}")
     
-    # 启动网段扫描器（后台线程）
-    network_scanner.start_scan_loop()
-    
-    # 兼容旧版本扫描器（降低频率）
-    scanner.start_loop()
+    # 启动网段调度器、历史数据清理和旧版 JSON 兼容（后台线程）
+    start_background()
     
     # 启动Web服务器
     app.run(host="0.0.0.0", port=5000, debug=True)
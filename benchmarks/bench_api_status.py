@@ -0,0 +1,121 @@
+"""/api/status 延迟基准
+
+在临时 SQLite 库中生成一批设备，用 Flask test client 反复请求 /api/status。
+  legacy    每次请求新建引擎并检查表结构（旧版 get_db_session），再查库生成数据
+  shared    使用进程共享的引擎和会话工厂，每次请求查库生成数据
+  snapshot  直接返回扫描后发布的内存快照
+  etag      带 If-None-Match 轮询内存快照，未变化时返回 304
+
+    python benchmarks/bench_api_status.py --devices 50 --requests 200
+    python benchmarks/bench_api_status.py --devices 10000 --requests 20 --modes shared,snapshot,etag
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp_dir = tempfile.mkdtemp(prefix="bench_status_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("NETWORK_SEGMENTS", "")
+
+import presence_snapshot  # noqa: E402
+from models import Base, Device, DeviceStatus, get_db_session, init_db  # noqa: E402
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+import app as app_module  # noqa: E402  导入 app 不会启动后台扫描线程
+
+init_db()
+
+SNAPSHOT_GET = presence_snapshot.get
+TYPES = ["电脑", "手机", "测试", None]
+
+
+def seed(count, online_ratio=0.3):
+    session = get_db_session()
+    try:
+        now = datetime.now()
+        devices = []
+        for i in range(count):
+            ip = f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}"
+            devices.append({"ip": ip, "name": f"设备{i}", "type": random.choice(TYPES), "first_seen": now})
+        session.execute(insert(Device), devices)
+        statuses = []
+        for device_id, in session.query(Device.id):
+            online = random.random() < online_ratio
+            statuses.append({
+                "device_id": device_id,
+                "is_online": online,
+                "last_seen": now - timedelta(minutes=random.randint(0, 120)),
+                "start_time": now - timedelta(hours=random.randint(1, 8)),
+                "response_time": random.uniform(0.2, 40) if online else None,
+                "last_check": now,
+            })
+        session.execute(insert(DeviceStatus), statuses)
+        session.commit()
+    finally:
+        session.close()
+
+
+def legacy_get_db_session():
+    engine = create_engine(os.environ["DATABASE_URL"])
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def use_mode(mode):
+    if mode == "legacy":
+        presence_snapshot.get = lambda: presence_snapshot.publish(legacy_get_db_session())
+    elif mode == "shared":
+        presence_snapshot.get = presence_snapshot.publish
+    else:
+        presence_snapshot.get = SNAPSHOT_GET
+
+
+def measure(client, requests, mode):
+    samples = []
+    headers = {}
+    if mode == "etag":
+        headers["If-None-Match"] = client.get("/api/status").headers["ETag"]
+    expected = 304 if mode == "etag" else 200
+    for _ in range(requests):
+        start = time.perf_counter()
+        res = client.get("/api/status", headers=headers)
+        samples.append((time.perf_counter() - start) * 1000)
+        assert res.status_code == expected, res.status_code
+    samples.sort()
+    return {
+        "mean": statistics.mean(samples),
+        "p50": samples[len(samples) // 2],
+        "p95": samples[int(len(samples) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--modes", default="etag,snapshot,shared,legacy",
+                        help="逗号分隔: etag,snapshot,shared,legacy（legacy 会遗留大量引擎对象，放在后面跑）")
+    args = parser.parse_args()
+
+    seed(args.devices)
+    client = app_module.app.test_client()
+
+    print(f"设备数 {args.devices}，每种模式 {args.requests} 次请求")
+    print(f"{'模式':<10}{'平均(ms)':>10}{'p50(ms)':>10}{'p95(ms)':>10}")
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        use_mode(mode)
+        measure(client, 5, mode)  # 预热
+        result = measure(client, args.requests, mode)
+        print(f"{mode:<10}{result['mean']:>10.2f}{result['p50']:>10.2f}{result['p95']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""SQLite 读写并发基准
+
+多个线程同时模拟扫描写入（scan_writer.write_scan_results），另有几个进程不停读取
+/api/status 所需的数据（status_service.build_status，相当于多个 Web 进程），比较：
+  default + direct   SQLite 默认回滚日志，各线程直接写（旧行为）
+  default + queue    SQLite 默认回滚日志，写入经 db_writer 单写线程排队
+  wal + direct       WAL 等连接参数，各线程直接写
+  wal + queue        WAL 等连接参数 + 单写线程（默认配置）
+统计写入/读取的吞吐、延迟分位数以及 "database is locked" 错误数。
+
+    python benchmarks/bench_db_contention.py --seconds 5 --writers 4 --readers 4
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import db_writer  # noqa: E402
+import models  # noqa: E402
+import scan_writer  # noqa: E402
+import status_service  # noqa: E402
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def setup(path, profile, writer_mode, hosts):
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    models.SQLITE_PROFILE = profile
+    db_writer.DB_WRITER_MODE = "on" if writer_mode == "queue" else "off"
+    models.dispose_engine()
+    models.init_db()
+    # 预先写入一轮，之后都是更新已有设备
+    for subnet in range(hosts // 254 + 1):
+        results = {f"10.0.{subnet}.{i}": 1.0 for i in range(1, 255)}
+        db_writer.execute(lambda session: scan_writer.write_scan_results(session, results))
+
+
+# 读进程：使用自己的连接池，持续读取 seconds 秒
+def reader(seconds, results):
+    models.dispose_engine()
+    latencies, locked, other = [], 0, 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        started = time.perf_counter()
+        session = models.get_db_session()
+        try:
+            status_service.build_status(session)
+            latencies.append((time.perf_counter() - started) * 1000)
+        except Exception as e:
+            if "locked" in str(e):
+                locked += 1
+            else:
+                other += 1
+        finally:
+            session.close()
+    results.put((latencies, locked, other))
+
+
+def run_case(profile, writer_mode, seconds, writers, readers, hosts):
+    tmp_dir = tempfile.mkdtemp(prefix="bench_contention_")
+    try:
+        setup(os.path.join(tmp_dir, "bench.db"), profile, writer_mode, hosts)
+        stop = threading.Event()
+        write_latency, read_latency = [], []
+        errors = {"write_locked": 0, "read_locked": 0, "other": 0}
+        lock = threading.Lock()
+
+        def record_error(kind, e):
+            with lock:
+                if "locked" in str(e):
+                    errors[kind] += 1
+                else:
+                    errors["other"] += 1
+
+        def writer(index):
+            subnet = index % (hosts // 254 + 1)
+            while not stop.is_set():
+                # 每轮随机 30% 在线，模拟一次网段扫描的写入
+                results = {f"10.0.{subnet}.{i}": (1.0 if random.random() < 0.3 else None) for i in range(1, 255)}
+                started = time.perf_counter()
+                try:
+                    db_writer.run(lambda session: scan_writer.write_scan_results(session, results))
+                    with lock:
+                        write_latency.append((time.perf_counter() - started) * 1000)
+                except Exception as e:
+                    record_error("write_locked", e)
+
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=reader, args=(seconds, results)) for _ in range(readers)]
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        for process in processes:
+            process.start()
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        for _ in processes:
+            latencies, locked, other = results.get()
+            read_latency.extend(latencies)
+            errors["read_locked"] += locked
+            errors["other"] += other
+        for process in processes:
+            process.join()
+        models.dispose_engine()
+
+        return {
+            "writes_per_sec": len(write_latency) / seconds,
+            "write_p50": statistics.median(write_latency) if write_latency else 0.0,
+            "write_p95": percentile(write_latency, 0.95),
+            "write_max": max(write_latency) if write_latency else 0.0,
+            "reads_per_sec": len(read_latency) / seconds,
+            "read_p50": statistics.median(read_latency) if read_latency else 0.0,
+            "read_p95": percentile(read_latency, 0.95),
+            **errors,
+        }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--writers", type=int, default=4, help="同时写入的扫描线程数")
+    parser.add_argument("--readers", type=int, default=4, help="同时读取状态的进程数")
+    parser.add_argument("--hosts", type=int, default=1016, help="设备数(按 /24 分给各写线程)")
+    parser.add_argument("--cases", default="default:direct,default:queue,wal:direct,wal:queue")
+    args = parser.parse_args()
+
+    print(f"{'配置':<18}{'写/秒':>8}{'写p50':>9}{'写p95':>9}{'写max':>9}{'读/秒':>8}{'读p50':>9}{'读p95':>9}{'写锁错':>7}{'读锁错':>7}{'其他':>5}")
+    for case in args.cases.split(","):
+        profile, writer_mode = case.split(":")
+        # default 表示不设置任何 PRAGMA，即 SQLite 默认的回滚日志
+        result = run_case("off" if profile == "default" else profile, writer_mode, args.seconds, args.writers, args.readers, args.hosts)
+        print(
+            f"{profile + ' + ' + writer_mode:<18}{result['writes_per_sec']:>8.1f}{result['write_p50']:>9.1f}"
+            f"{result['write_p95']:>9.1f}{result['write_max']:>9.1f}{result['reads_per_sec']:>8.1f}"
+            f"{result['read_p50']:>9.1f}{result['read_p95']:>9.1f}{result['write_locked']:>7}"
+            f"{result['read_locked']:>7}{result['other']:>5}"
+        )
+
+
+if __name__ == "__main__":
+    main()
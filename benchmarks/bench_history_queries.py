@@ -0,0 +1,200 @@
+"""device_history / scan_logs 查询计划与耗时基准
+
+在临时 SQLite 库中生成指定行数的历史记录，分别在没有和有迁移 2 新增的索引时，
+记录各类查询的 EXPLAIN QUERY PLAN 和耗时中位数：
+  device_day     单设备一天（/api/history/<ip>?period=daily）
+  device_month   单设备三十天
+  bulk_day       20 台设备一天，按 (device_id, timestamp) 排序（/api/history 批量）
+  retention      统计保留期之前的记录数（cleanup_history 的删除条件）
+  last_scan      max(scan_logs.timestamp)（/api/status）
+  network_scans  单网段最近一次扫描
+
+    python benchmarks/bench_history_queries.py --rows 1000000
+    python benchmarks/bench_history_queries.py --rows 1000000,10000000 --output plans.md
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+INDEXES = [
+    ("ix_device_history_device_timestamp", "device_history", "device_id, timestamp"),
+    ("ix_scan_logs_timestamp", "scan_logs", "timestamp"),
+    ("ix_scan_logs_network_id", "scan_logs", "network_id"),
+]
+DAYS = 30
+NETWORKS = 4
+
+
+def create_schema(path):
+    # 用项目自己的模型和迁移建表，保证索引定义与线上一致
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    import models
+    models.dispose_engine()
+    models.init_db()
+    models.dispose_engine()
+
+
+def fmt_time(value):
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+def seed(conn, rows, devices, now):
+    # 每台设备按相同间隔检测，覆盖最近 DAYS 天
+    per_device = max(1, rows // devices)
+    step = timedelta(days=DAYS) / per_device
+    start = now - timedelta(days=DAYS)
+    conn.executemany(
+        "INSERT INTO devices (id, ip, first_seen, last_modified) VALUES (?, ?, ?, ?)",
+        [(i, f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}", fmt_time(start), fmt_time(start)) for i in range(1, devices + 1)]
+    )
+    conn.executemany(
+        "INSERT INTO networks (id, name, cidr, is_active, scan_interval) VALUES (?, ?, ?, 1, 30)",
+        [(i, f"网段{i}", f"10.{i}.0.0/24") for i in range(1, NETWORKS + 1)]
+    )
+
+    batch = []
+    inserted = 0
+    # 按时间顺序交错写入各设备，与扫描线程的写入顺序一致
+    for n in range(per_device):
+        timestamp = fmt_time(start + step * n)
+        for device_id in range(1, devices + 1):
+            online = random.random() < 0.6
+            batch.append((device_id, timestamp, online, random.uniform(0.5, 20) if online else None))
+        if len(batch) >= 100000:
+            conn.executemany("INSERT INTO device_history (device_id, timestamp, is_online, response_time) VALUES (?, ?, ?, ?)", batch)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO device_history (device_id, timestamp, is_online, response_time) VALUES (?, ?, ?, ?)", batch)
+        inserted += len(batch)
+
+    scans = []
+    scan_step = timedelta(seconds=30)
+    scan_count = min(per_device, 200000)
+    for n in range(scan_count):
+        scans.append((fmt_time(now - scan_step * (scan_count - n)), n % NETWORKS + 1, 0.5, devices, devices // 2))
+    conn.executemany(
+        "INSERT INTO scan_logs (timestamp, network_id, duration, devices_total, devices_online) VALUES (?, ?, ?, ?, ?)", scans
+    )
+    conn.commit()
+    return inserted, len(scans)
+
+
+def queries(devices, now):
+    device_id = devices // 2
+    day = fmt_time(now - timedelta(days=1))
+    month = fmt_time(now - timedelta(days=DAYS))
+    bulk = ", ".join(str(i) for i in range(1, min(devices, 20) + 1))
+    retention = fmt_time(now - timedelta(days=DAYS - 7))
+    return [
+        ("device_day",
+         "SELECT timestamp, is_online, response_time FROM device_history WHERE device_id = ? AND timestamp >= ? ORDER BY timestamp",
+         (device_id, day)),
+        ("device_month",
+         "SELECT timestamp, is_online, response_time FROM device_history WHERE device_id = ? AND timestamp >= ? ORDER BY timestamp",
+         (device_id, month)),
+        ("bulk_day",
+         f"SELECT device_id, timestamp, is_online, response_time FROM device_history WHERE device_id IN ({bulk}) "
+         "AND timestamp >= ? ORDER BY device_id, timestamp",
+         (day,)),
+        ("retention",
+         "SELECT count(*) FROM device_history WHERE timestamp < ?",
+         (retention,)),
+        ("last_scan",
+         "SELECT max(timestamp) FROM scan_logs",
+         ()),
+        ("network_scans",
+         "SELECT max(timestamp) FROM scan_logs WHERE network_id = ?",
+         (1,)),
+    ]
+
+
+def explain(conn, sql, params):
+    return "; ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+
+
+def measure(conn, sql, params, repeat):
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = len(conn.execute(sql, params).fetchall())
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), rows
+
+
+def run(rows, devices, repeat, report):
+    tmp_dir = tempfile.mkdtemp(prefix="bench_history_")
+    path = os.path.join(tmp_dir, "bench.db")
+    try:
+        create_schema(path)
+        conn = sqlite3.connect(path)
+        now = datetime.now()
+
+        started = time.perf_counter()
+        inserted, scans = seed(conn, rows, devices, now)
+        print(f"\n== {inserted:,} 条历史记录, {devices} 台设备, {scans:,} 条扫描日志 (生成 {time.perf_counter() - started:.1f} 秒)")
+        report.append(f"\n## {inserted:,} 条历史记录 / {devices} 台设备 / {scans:,} 条扫描日志\n")
+
+        results = {}
+        for variant in ("without", "with"):
+            if variant == "without":
+                for name, _, _ in INDEXES:
+                    conn.execute(f"DROP INDEX IF EXISTS {name}")
+            else:
+                for name, table, columns in INDEXES:
+                    started = time.perf_counter()
+                    conn.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+                    print(f"   创建 {name}: {time.perf_counter() - started:.2f} 秒")
+            conn.execute("ANALYZE")
+            conn.commit()
+
+            for name, sql, params in queries(devices, now):
+                plan = explain(conn, sql, params)
+                elapsed, count = measure(conn, sql, params, repeat)
+                results[(name, variant)] = (elapsed, count, plan)
+
+        report.append("| 查询 | 行数 | 无索引 (ms) | 有索引 (ms) | 有索引时的查询计划 |")
+        report.append("|---|---:|---:|---:|---|")
+        for name, _, _ in queries(devices, now):
+            before, count, _ = results[(name, "without")]
+            after, _, plan = results[(name, "with")]
+            print(f"   {name:<14} {count:>8} 行  无索引 {before:>9.2f} ms  有索引 {after:>9.2f} ms")
+            print(f"   {'':<14} 无索引: {results[(name, 'without')][2]}")
+            print(f"   {'':<14} 有索引: {plan}")
+            report.append(f"| {name} | {count} | {before:.2f} | {after:.2f} | {plan} |")
+        conn.close()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="device_history 索引与查询计划基准")
+    parser.add_argument("--rows", default="1000000", help="历史记录行数，逗号分隔可测多组，例如 1000000,10000000")
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="把结果写成 Markdown 表格")
+    args = parser.parse_args()
+
+    random.seed(42)
+    report = ["# device_history 查询计划基准"]
+    for rows in args.rows.split(","):
+        run(int(rows), args.devices, args.repeat, report)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write("\n".join(report) + "\n")
+        print(f"\n结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""按主机估算探测超时的基准（模拟延迟）
+
+在虚拟时间中模拟一个网段的多轮扫描，对比固定参数(1.5 秒 × 2 次)与 rtt_estimator 按主机估算的
+超时/重试次数。主机分几类：有线（亚毫秒）、Wi-Fi（数十毫秒，偶尔因省电模式延迟数百毫秒）、
+慢速设备（数百毫秒），每个包按 --loss 概率丢失，在线设备每轮按 --churn 概率真的离线；
+其余地址从不响应。探测行为与 icmp_prober 一致：每台主机按自己的超时重发，
+晚到的应答只要在最后一次超时前到达仍然算在线。统计：
+  sweep     整轮耗时（共用套接字时所有主机并发，取最慢的主机）
+  slot      所有主机占用探测时间之和（线程池后端中即占用工作线程的秒数）
+  packets   发出的包数
+  false     在线主机被判为离线的比例
+
+    python benchmarks/bench_probe_timeouts.py --cycles 50 --loss 0.02
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rtt_estimator  # noqa: E402
+
+# 类别: (中位延迟ms, 抖动系数, 偶发高延迟概率, 偶发高延迟范围ms)
+CLASSES = {
+    "wired": (0.4, 0.3, 0.0, (0, 0)),
+    "wifi": (15.0, 0.6, 0.05, (200, 800)),
+    "slow": (350.0, 0.3, 0.02, (800, 1400)),
+}
+
+
+def make_hosts(count, live_ratio, mix):
+    hosts = []
+    live = int(count * live_ratio)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    for i in range(count):
+        kind = random.choices(names, weights)[0] if i < live else "dead"
+        hosts.append((f"10.0.{i // 254}.{i % 254 + 1}", kind))
+    return hosts
+
+
+def sample_rtt(kind):
+    median, jitter, spike, spike_range = CLASSES[kind]
+    if random.random() < spike:
+        return random.uniform(*spike_range)
+    return median * random.lognormvariate(0, jitter)
+
+
+# 模拟探测一台主机，返回 (响应时间ms 或 None, 占用秒数, 发包数)
+def probe(kind, up, timeout, retries, loss):
+    answer = None  # (到达时间, 响应时间)
+    packets = 0
+    for attempt in range(retries):
+        sent = attempt * timeout
+        if answer is not None and answer[0] <= sent:
+            break
+        packets += 1
+        if kind == "dead" or not up or random.random() < loss:
+            continue
+        rtt = sample_rtt(kind) / 1000
+        if answer is None or sent + rtt < answer[0]:
+            answer = (sent + rtt, rtt)
+    deadline = retries * timeout
+    if answer is not None and answer[0] <= deadline:
+        return answer[1] * 1000, answer[0], packets
+    return None, deadline, packets
+
+
+def run(policy, hosts, cycles, warmup, loss, churn, seed):
+    random.seed(seed)
+    estimator = rtt_estimator.RttEstimator(enabled=True)
+    sweeps, slots, packets = [], [], []
+    live_checks = 0
+    false_offline = {kind: [0, 0] for kind in CLASSES}
+
+    for cycle in range(cycles):
+        plan = estimator.plan([ip for ip, _ in hosts]) if policy == "adaptive" else {}
+        results = {}
+        cycle_sweep = cycle_slot = cycle_packets = 0
+        for ip, kind in hosts:
+            timeout, retries = plan.get(ip, (1.5, 2))
+            up = kind != "dead" and random.random() >= churn
+            rtt, busy, sent = probe(kind, up, timeout, retries, loss)
+            results[ip] = rtt
+            cycle_sweep = max(cycle_sweep, busy)
+            cycle_slot += busy
+            cycle_packets += sent
+            if up and cycle >= warmup:
+                live_checks += 1
+                false_offline[kind][1] += 1
+                if rtt is None:
+                    false_offline[kind][0] += 1
+        estimator.observe(results)
+        if cycle >= warmup:
+            sweeps.append(cycle_sweep)
+            slots.append(cycle_slot)
+            packets.append(cycle_packets)
+
+    missed = sum(missed for missed, _ in false_offline.values())
+    return {
+        "sweep": statistics.mean(sweeps),
+        "sweep_max": max(sweeps),
+        "slot": statistics.mean(slots),
+        "packets": statistics.mean(packets),
+        "false": missed / live_checks if live_checks else 0.0,
+        "by_class": {kind: (m / n if n else 0.0) for kind, (m, n) in false_offline.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hosts", type=int, default=254, help="网段地址数")
+    parser.add_argument("--live-ratio", type=float, default=0.3, help="有设备的地址比例")
+    parser.add_argument("--mix", default="wired:0.4,wifi:0.5,slow:0.1", help="在线设备的类别比例")
+    parser.add_argument("--loss", type=float, default=0.02, help="单个包的丢失概率")
+    parser.add_argument("--churn", type=float, default=0.05, help="在线设备某一轮真的离线的概率")
+    parser.add_argument("--cycles", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3, help="不计入统计的前几轮（估计值尚未收敛）")
+    parser.add_argument("--only-known", action="store_true", help="只探测有设备的地址（相当于 adaptive 探测调度的稳定状态）")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    mix = {name: float(weight) for name, weight in (item.split(":") for item in args.mix.split(","))}
+    hosts = make_hosts(args.hosts, args.live_ratio, mix)
+    if args.only_known:
+        hosts = [(ip, kind) for ip, kind in hosts if kind != "dead"]
+
+    print(f"{len(hosts)} 个地址, 丢包 {args.loss:.0%}, 离线概率 {args.churn:.0%}, {args.cycles} 轮 (前 {args.warmup} 轮不计)")
+    print(f"{'策略':<10}{'整轮(s)':>9}{'最慢(s)':>9}{'占用(s)':>9}{'发包':>8}{'误判离线':>10}  " + "  ".join(f"{kind:>7}" for kind in CLASSES))
+    for policy in ("fixed", "adaptive"):
+        result = run(policy, hosts, args.cycles, args.warmup, args.loss, args.churn, args.seed)
+        print(
+            f"{policy:<10}{result['sweep']:>9.2f}{result['sweep_max']:>9.2f}{result['slot']:>9.1f}{result['packets']:>8.0f}"
+            f"{result['false']:>10.3%}  " + "  ".join(f"{result['by_class'][kind]:>7.2%}" for kind in CLASSES)
+        )
+
+
+if __name__ == "__main__":
+    main()
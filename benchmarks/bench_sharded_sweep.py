@@ -0,0 +1,74 @@
+"""多进程分片扫描基准
+
+对回环网段(127.0.0.0/N，所有地址都会应答)做真实 ICMP 扫描，比较在扫描线程内探测
+(--processes 含 0)与分片交给 1/2/4... 个子进程探测的整轮耗时，包括父进程汇总结果和写库。
+回环地址的应答几乎没有延迟，耗时主要是收发和解析报文的 CPU 开销，正是多进程要分摊的部分。
+需要能打开 ICMP 套接字（root 或 net.ipv4.ping_group_range）。
+
+    python benchmarks/bench_sharded_sweep.py --cidr 127.0.0.0/20 --processes 0,1,2,4
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 使用临时数据库；每轮都探测整个网段，不使用邻居表和离线防抖
+_tmp_dir = tempfile.mkdtemp(prefix="bench_sharded_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ["PROBE_SCHEDULE"] = "all"
+os.environ["NEIGHBOR_DISCOVERY"] = "off"
+os.environ["PRESENCE_REPROBES"] = "0"
+
+import network_scanner  # noqa: E402
+import probe_strategy  # noqa: E402
+import scan_pool  # noqa: E402
+from models import init_db  # noqa: E402
+
+
+def run_case(cidr, processes, repeat):
+    scan_pool.shutdown()
+    scan_pool.SCAN_PROCESSES = processes
+    if processes:
+        # 先启动子进程，不把进程启动时间算进扫描耗时
+        scan_pool.sweep(["127.0.0.1"] * processes, timeout=0.5, retries=1)
+    timings = []
+    online = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        online = network_scanner.scan_network(cidr)
+        timings.append(time.perf_counter() - started)
+    return min(timings), sum(timings) / len(timings), online
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cidr", default="127.0.0.0/20")
+    parser.add_argument("--processes", default="0,1,2,4", help="逗号分隔的子进程数，0 表示在扫描线程内探测")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    try:
+        init_db()
+        probe_strategy.set_backend(probe_strategy.BACKEND_ICMP)
+        network_scanner.get_hostname = lambda ip, timeout=1: None
+        hosts = network_scanner.ipaddress.ip_network(args.cidr).num_addresses - 2
+        # 第一轮会新建全部设备，先扫一次让之后都是更新
+        network_scanner.scan_network(args.cidr)
+
+        print(f"{args.cidr}: {hosts} 个地址, CPU {os.cpu_count()} 核")
+        print(f"{'子进程':>6}{'最快(s)':>10}{'平均(s)':>10}{'在线':>7}{'主机/秒':>10}")
+        for processes in [int(p) for p in args.processes.split(",")]:
+            best, mean, online = run_case(args.cidr, processes, args.repeat)
+            print(f"{processes:>6}{best:>10.2f}{mean:>10.2f}{online:>7}{hosts / best:>10.0f}")
+    finally:
+        scan_pool.shutdown()
+        shutil.rmtree(_tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""网段扫描耗时基准
+
+用模拟的 is_online 代替真实 ping：在线主机很快返回，离线主机耗尽超时+重试。
+对比逐个扫描(workers=1)与并发扫描在 /24、/22 网段上的整轮耗时（含写库）。
+--cycles N 另外以 adaptive 探测调度连续扫描 N 轮，观察每轮实际探测的地址数和耗时。
+
+    python benchmarks/bench_sweep.py --dead-cost 0.05 --live-ratio 0.05
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 使用临时数据库，避免污染 presence.db
+_tmp_dir = tempfile.mkdtemp(prefix="bench_sweep_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# 对比整轮耗时时每轮都探测整个网段；邻居表中没有模拟的地址，关闭
+os.environ["PROBE_SCHEDULE"] = "all"
+os.environ["NEIGHBOR_DISCOVERY"] = "off"
+
+import network_scanner  # noqa: E402
+from models import init_db  # noqa: E402
+
+
+def make_fake_is_online(live_ratio, live_cost, dead_cost):
+    step = max(1, int(round(1 / live_ratio))) if live_ratio > 0 else 0
+
+    def fake_is_online(ip, timeout=1, retries=2):
+        last_octets = int(ip.split(".")[-1]) + int(ip.split(".")[-2]) * 256
+        if step and last_octets % step == 0:
+            time.sleep(live_cost)
+            return True, live_cost * 1000
+        # 离线主机：ping3 重试 + 系统 ping 重试都要等满超时
+        time.sleep(dead_cost)
+        return False, None
+
+    return fake_is_online
+
+
+def run(cidr, workers):
+    start = time.perf_counter()
+    online = network_scanner.scan_network(cidr, workers=workers)
+    return time.perf_counter() - start, online
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dead-cost", type=float, default=0.05, help="模拟离线主机一次探测的耗时(秒)")
+    parser.add_argument("--live-cost", type=float, default=0.002, help="模拟在线主机一次探测的耗时(秒)")
+    parser.add_argument("--live-ratio", type=float, default=0.05, help="在线主机比例")
+    parser.add_argument("--workers", default="1,16,64,256", help="逗号分隔的并发数列表")
+    parser.add_argument("--cidrs", default="10.0.0.0/24,10.1.0.0/22", help="逗号分隔的网段列表")
+    parser.add_argument("--skip-sequential-22", action="store_true", help="跳过 /22 的逐个扫描(很慢)")
+    parser.add_argument("--cycles", type=int, default=0, help="以 adaptive 调度连续扫描的轮数(0 不测)")
+    args = parser.parse_args()
+
+    init_db()
+    # 走线程池路径，用模拟探测代替真实 ping
+    network_scanner.probe_strategy.set_backend(network_scanner.probe_strategy.BACKEND_SUBPROCESS)
+    network_scanner.probe_strategy.is_online = make_fake_is_online(args.live_ratio, args.live_cost, args.dead_cost)
+    # 主机名解析会走真实 DNS，基准中关闭
+    network_scanner.get_hostname = lambda ip, timeout=1: None
+
+    print(f"{'网段':<16}{'并发':>6}{'用时(s)':>10}{'在线':>6}{'主机/秒':>10}")
+    for cidr in [c.strip() for c in args.cidrs.split(",") if c.strip()]:
+        hosts = network_scanner.ipaddress.ip_network(cidr).num_addresses - 2
+        for workers in [int(w) for w in args.workers.split(",")]:
+            if workers == 1 and args.skip_sequential_22 and hosts > 254:
+                continue
+            elapsed, online = run(cidr, workers)
+            print(f"{cidr:<16}{workers:>6}{elapsed:>10.2f}{online:>6}{hosts / elapsed:>10.0f}")
+
+    if args.cycles:
+        run_cycles(args.cidrs.split(",")[-1].strip(), int(args.workers.split(",")[-1]), args.cycles)
+
+
+# 同一网段连续扫描多轮，统计每轮实际探测数；模拟时间每轮前进 30 秒
+def run_cycles(cidr, workers, cycles):
+    schedule = network_scanner.probe_schedule.ProbeSchedule(mode="adaptive")
+    network_scanner.probe_schedule._schedule = schedule
+    clock = [time.time()]
+    plan, record = schedule.plan, schedule.record
+    schedule.plan = lambda ips, known, now=None: plan(ips, known, clock[0])
+    schedule.record = lambda results, known, online=(), now=None: record(results, known, online, clock[0])
+
+    print(f"\nadaptive 调度: {cidr}, 并发 {workers}")
+    print(f"{'轮次':>4}{'探测':>8}{'跳过':>8}{'在线':>6}{'用时(s)':>10}")
+    for cycle in range(1, cycles + 1):
+        before = schedule.stats()
+        elapsed, online = run(cidr, workers)
+        after = schedule.stats()
+        print(f"{cycle:>4}{after['planned'] - before['planned']:>8}{after['skipped'] - before['skipped']:>8}{online:>6}{elapsed:>10.2f}")
+        clock[0] += 30
+
+
+if __name__ == "__main__":
+    main()
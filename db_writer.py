@@ -0,0 +1,174 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from models import get_db_session, get_engine
+
+logger = logging.getLogger('db_writer')
+
+# 单写线程：所有写操作排队由同一个线程依次执行，SQLite 同一时刻只有一个写事务，
+# 扫描线程和接口之间不会互相等锁而报 "database is locked"
+# auto 仅在 SQLite 上启用；on 总是启用；off 在调用线程里直接执行
+DB_WRITER_MODE = os.environ.get('DB_WRITER', 'auto').lower()
+# 等待写操作完成的最长秒数
+DB_WRITER_TIMEOUT = float(os.environ.get('DB_WRITER_TIMEOUT', 60))
+# 一个事务最多合并的写操作数，以及取到第一个写操作后再等待后续写操作的秒数
+DB_WRITER_BATCH_SIZE = int(os.environ.get('DB_WRITER_BATCH_SIZE', 32))
+DB_WRITER_BATCH_WINDOW = float(os.environ.get('DB_WRITER_BATCH_WINDOW', 0.05))
+
+# 写线程把排队的写操作按数量/时间窗口合并到一个事务里提交，一次 fsync 覆盖多个网段的扫描结果
+class DbWriter:
+    def __init__(self, batch_size=DB_WRITER_BATCH_SIZE, batch_window=DB_WRITER_BATCH_WINDOW):
+        self.batch_size = max(1, batch_size)
+        self.batch_window = batch_window
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.errors = 0
+        self.commits = 0
+        self.last_batch = 0
+        self.max_batch = 0
+        self.max_queue_depth = 0
+        self.busy_seconds = 0.0
+        self.commit_seconds = 0.0
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self.loop, daemon=True, name="DbWriter")
+                    self._thread.start()
+
+    # 取出一批写操作：先阻塞等第一个，再在时间窗口内尽量多取
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.time()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def loop(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            started = time.time()
+            try:
+                self._run_batch(batch)
+            finally:
+                self.jobs += len(batch)
+                self.last_batch = len(batch)
+                self.max_batch = max(self.max_batch, len(batch))
+                self.busy_seconds += time.time() - started
+
+    # 写操作轮到执行时才标记为运行中，排队期间被调用方取消（等待超时）的直接丢弃
+    def _run_batch(self, batch):
+        session = get_db_session()
+        running = []
+        try:
+            results = []
+            for func, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                running.append(future)
+                results.append(func(session))
+            if not running:
+                return
+            commit_started = time.time()
+            session.commit()
+            self.commit_seconds += time.time() - commit_started
+            self.commits += 1
+        except Exception as e:
+            session.rollback()
+            results = None
+            if len(batch) > 1:
+                logger.warning(f"合并的 {len(batch)} 个写操作提交失败，逐个重试: {str(e)}")
+        finally:
+            session.close()
+
+        if results is not None:
+            for future, result in zip(running, results):
+                future.set_result(result)
+            return
+
+        # 整批失败时逐个重新执行，只让出错的那个写操作失败；出错后还没轮到的写操作同样先检查是否已取消
+        for func, future in batch:
+            if future.cancelled() or (not future.running() and not future.set_running_or_notify_cancel()):
+                continue
+            try:
+                future.set_result(execute(func))
+                self.commits += 1
+            except Exception as e:
+                self.errors += 1
+                future.set_exception(e)
+
+    # 提交写操作 func(session)，返回 Future；func 不要自己提交，可能与其他写操作合并在同一事务中
+    def submit(self, func):
+        future = Future()
+        if threading.current_thread() is self._thread:
+            # 写线程内再提交写操作时直接执行，避免自己等自己
+            try:
+                future.set_result(execute(func))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self._ensure_started()
+        self._queue.put((func, future))
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return future
+
+    def stats(self):
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_queue_depth,
+            "jobs": self.jobs,
+            "errors": self.errors,
+            "commits": self.commits,
+            "last_batch": self.last_batch,
+            "max_batch": self.max_batch,
+            "avg_batch": round(self.jobs / self.commits, 2) if self.commits else 0,
+            "avg_commit_ms": round(self.commit_seconds / self.commits * 1000, 2) if self.commits else 0,
+            "busy_seconds": round(self.busy_seconds, 3)
+        }
+
+# 在一个新会话中执行 func(session) 并提交
+def execute(func):
+    session = get_db_session()
+    try:
+        result = func(session)
+        session.commit()
+        return result
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+_writer = DbWriter()
+
+def enabled():
+    if DB_WRITER_MODE == 'auto':
+        return get_engine().dialect.name == 'sqlite'
+    return DB_WRITER_MODE == 'on'
+
+# 执行写操作 func(session) 并等待结果；启用单写线程时排队执行，否则在当前线程执行
+# 等待超时时取消还在排队的写操作，调用方按失败处理后它不会再提交；已经开始执行的无法取消
+def run(func, timeout=DB_WRITER_TIMEOUT):
+    if not enabled():
+        return execute(func)
+    future = _writer.submit(func)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        future.cancel()
+        raise
+
+def get_writer():
+    return _writer
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger('history_log')
+
+# 旧版历史记录改为按天分段的追加式 NDJSON：history/YYYY-MM-DD.ndjson，每行一条
+#   {"timestamp": "YYYY-mm-dd HH:MM:SS", "online": [ip, ...]}
+# 追加只写当天文件末尾；裁剪直接删除过期的整天文件；读取时跳过截止日期之前的文件，
+# 并在第一个文件内按字节偏移二分定位到截止时间
+HISTORY_DIR = os.environ.get('LEGACY_HISTORY_DIR', 'history')
+HISTORY_RETENTION_DAYS = 7
+LEGACY_HISTORY_FILE = 'history.json'
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+SEGMENT_SUFFIX = '.ndjson'
+
+_lock = threading.Lock()
+_migrated = False
+
+def _segment_path(day, directory=None):
+    return os.path.join(directory or HISTORY_DIR, f"{day}{SEGMENT_SUFFIX}")
+
+# 返回 [(日期字符串, 路径)]，按日期升序
+def list_segments(directory=None):
+    directory = directory or HISTORY_DIR
+    if not os.path.isdir(directory):
+        return []
+    segments = []
+    for name in os.listdir(directory):
+        if name.endswith(SEGMENT_SUFFIX):
+            day = name[:-len(SEGMENT_SUFFIX)]
+            segments.append((day, os.path.join(directory, name)))
+    segments.sort()
+    return segments
+
+def _timestamp_of(line):
+    return json.loads(line)["timestamp"]
+
+# 追加一条记录，O(1)
+def append(timestamp, online_ips, directory=None):
+    _ensure_migrated(directory)
+    directory = directory or HISTORY_DIR
+    line = json.dumps({"timestamp": timestamp, "online": list(online_ips)}, ensure_ascii=False) + "\n"
+    with _lock:
+        os.makedirs(directory, exist_ok=True)
+        with open(_segment_path(timestamp[:10], directory), "a", encoding="utf-8") as f:
+            f.write(line)
+
+# 删除保留期之前的整天分段，返回删除的文件数
+def trim(retention_days=HISTORY_RETENTION_DAYS, now=None, directory=None):
+    cutoff_day = ((now or datetime.now()) - timedelta(days=retention_days)).strftime('%Y-%m-%d')
+    removed = 0
+    with _lock:
+        for day, path in list_segments(directory):
+            if day < cutoff_day:
+                os.remove(path)
+                removed += 1
+    return removed
+
+# 在按时间排序的分段文件中二分查找第一条 timestamp >= cutoff 的行首
+def _seek_to(f, cutoff):
+    f.seek(0, os.SEEK_END)
+    lo, hi = 0, f.tell()
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(mid)
+        if mid > 0:
+            f.readline()  # 跳过被截断的半行
+        line = f.readline()
+        timestamp = None
+        while line:
+            try:
+                timestamp = _timestamp_of(line)
+                break
+            except (ValueError, KeyError):
+                # 进程中断可能留下半行，跳过，用下一行比较
+                line = f.readline()
+        if timestamp is not None and timestamp < cutoff:
+            lo = mid + 1
+        else:
+            hi = mid
+    f.seek(lo)
+    if lo > 0:
+        f.readline()
+
+# 逐条读取 cutoff(datetime，None 表示全部) 之后的记录
+def read_since(cutoff=None, directory=None):
+    _ensure_migrated(directory)
+    cutoff_str = cutoff.strftime(TIME_FORMAT) if cutoff else None
+    for day, path in list_segments(directory):
+        if cutoff_str and day < cutoff_str[:10]:
+            continue
+        try:
+            with open(path, "rb") as f:
+                if cutoff_str and day == cutoff_str[:10]:
+                    _seek_to(f, cutoff_str)
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # 进程中断可能留下半行，跳过
+                        continue
+        except FileNotFoundError:
+            # 读取过程中被裁剪掉
+            continue
+
+# 首次使用时把旧的 history.json 拆分为按天分段，原文件改名保留
+def _ensure_migrated(directory=None):
+    global _migrated
+    if _migrated:
+        return
+    with _lock:
+        if _migrated:
+            return
+        _migrated = True
+        directory = directory or HISTORY_DIR
+        if not os.path.exists(LEGACY_HISTORY_FILE) or list_segments(directory):
+            return
+        try:
+            with open(LEGACY_HISTORY_FILE, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            if not isinstance(entries, list):
+                entries = []
+            entries.sort(key=lambda entry: entry.get("timestamp", ""))
+
+            os.makedirs(directory, exist_ok=True)
+            handles = {}
+            try:
+                for entry in entries:
+                    timestamp = entry.get("timestamp")
+                    if not timestamp:
+                        continue
+                    day = timestamp[:10]
+                    if day not in handles:
+                        handles[day] = open(_segment_path(day, directory), "a", encoding="utf-8")
+                    handles[day].write(json.dumps(
+                        {"timestamp": timestamp, "online": entry.get("online", [])}, ensure_ascii=False
+                    ) + "\n")
+            finally:
+                for handle in handles.values():
+                    handle.close()
+
+            os.replace(LEGACY_HISTORY_FILE, LEGACY_HISTORY_FILE + ".migrated")
+            logger.info(f"已将 {LEGACY_HISTORY_FILE} 中 {len(entries)} 条记录迁移到 {directory}/")
+        except Exception as e:
+            logger.error(f"迁移 {LEGACY_HISTORY_FILE} 失败: {str(e)}")
@@ -0,0 +1,222 @@
+import csv
+import io
+import ipaddress
+import json
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from models import Device, DeviceHistory, PresenceInterval, PresenceRollup
+import presence_intervals
+import presence_rollups
+
+logger = logging.getLogger('history_query')
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# 每次从游标取的行数
+FETCH_SIZE = 2000
+# IN 查询每批的设备数
+CHUNK_SIZE = 500
+
+# ?format= 支持的输出格式及对应的 Content-Type
+FORMATS = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+CSV_FIELDS = ["timestamp", "online", "response_time", "online_ratio", "samples", "rtt_min", "rtt_max"]
+
+PERIODS = {
+    "daily": timedelta(days=1),
+    "weekly": timedelta(weeks=1),
+    "monthly": timedelta(days=30),
+}
+
+# 解析时间参数，支持 "YYYY-mm-dd HH:MM:SS"、"YYYY-mm-dd" 和 ISO 格式
+def parse_time(value):
+    for fmt in (TIME_FORMAT, "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return datetime.fromisoformat(value)
+
+# 由 period 或 start/end 得到查询范围 (start, end)
+def resolve_range(period=None, start=None, end=None, now=None):
+    now = now or datetime.now()
+    end = parse_time(end) if end else now
+    if start:
+        return parse_time(start), end
+    return end - PERIODS.get(period, PERIODS["daily"]), end
+
+# 按 IP 列表、设备类型、网段筛选设备，返回 [(device_id, ip)]，按 device_id 排序
+def select_devices(session, ips=None, device_type=None, network=None):
+    query = session.query(Device.id, Device.ip)
+    if ips:
+        query = query.filter(Device.ip.in_(ips))
+    if device_type:
+        query = query.filter(Device.type == device_type)
+    devices = query.order_by(Device.id).all()
+    if network:
+        subnet = ipaddress.ip_network(network, strict=False)
+        devices = [(device_id, ip) for device_id, ip in devices if ipaddress.ip_address(ip) in subnet]
+    return [(device_id, ip) for device_id, ip in devices]
+
+# 只有汇总数据覆盖到查询起点时才使用汇总，否则退回原始记录：
+# 扫描器从升级后第一轮开始写汇总，升级前（且未补算）的历史只在原始记录中；
+# 某个设备最早的汇总晚于起点、且在这之前有原始记录，即视为未覆盖
+def effective_resolution(session, device_ids, resolution, start, end):
+    if resolution == 'raw' or not device_ids:
+        return resolution
+    first = {}
+    for i in range(0, len(device_ids), CHUNK_SIZE):
+        first.update(
+            session.query(PresenceRollup.device_id, func.min(PresenceRollup.bucket_start))
+            .filter(PresenceRollup.device_id.in_(device_ids[i:i + CHUNK_SIZE]))
+            .filter(PresenceRollup.resolution == resolution)
+            .group_by(PresenceRollup.device_id)
+            .all()
+        )
+    if not first:
+        return 'raw'
+    covered = presence_rollups.bucket_start(start, resolution)
+    for device_id in device_ids:
+        first_bucket = first.get(device_id)
+        if first_bucket is not None and first_bucket <= covered:
+            continue
+        if _has_raw(session, device_id, start, min(first_bucket or end, end)):
+            return 'raw'
+    return resolution
+
+# 设备在 [start, end) 内是否有原始记录（区间模式下为区间）
+def _has_raw(session, device_id, start, end):
+    if start >= end:
+        return False
+    if not presence_intervals.stores_samples():
+        query = session.query(PresenceInterval.id)\
+            .filter(PresenceInterval.device_id == device_id)\
+            .filter(PresenceInterval.end_time >= start)\
+            .filter(PresenceInterval.start_time < end)
+    else:
+        query = session.query(DeviceHistory.id)\
+            .filter(DeviceHistory.device_id == device_id)\
+            .filter(DeviceHistory.timestamp >= start)\
+            .filter(DeviceHistory.timestamp < end)
+    return query.first() is not None
+
+# 用一条查询按 (device_id, 时间) 顺序逐行产出 (device_id, 数据点)，游标分批读取，内存占用恒定
+def iter_points(session, device_ids, start, end, resolution='raw', fetch_size=FETCH_SIZE):
+    if not device_ids:
+        return
+
+    if resolution != 'raw':
+        rows = session.query(PresenceRollup)\
+            .filter(PresenceRollup.device_id.in_(device_ids))\
+            .filter(PresenceRollup.resolution == resolution)\
+            .filter(PresenceRollup.bucket_start >= presence_rollups.bucket_start(start, resolution))\
+            .filter(PresenceRollup.bucket_start < end)\
+            .order_by(PresenceRollup.device_id, PresenceRollup.bucket_start)\
+            .yield_per(fetch_size)
+        for row in rows:
+            yield row.device_id, presence_rollups.rollup_point(row)
+        return
+
+    if not presence_intervals.stores_samples():
+        rows = session.query(PresenceInterval)\
+            .filter(PresenceInterval.device_id.in_(device_ids))\
+            .filter(PresenceInterval.end_time >= start)\
+            .filter(PresenceInterval.start_time < end)\
+            .order_by(PresenceInterval.device_id, PresenceInterval.start_time)\
+            .yield_per(fetch_size)
+        for interval in rows:
+            for point in presence_intervals.expand_interval(interval, start, end):
+                yield interval.device_id, point
+        return
+
+    rows = session.query(DeviceHistory.device_id, DeviceHistory.timestamp, DeviceHistory.is_online, DeviceHistory.response_time)\
+        .filter(DeviceHistory.device_id.in_(device_ids))\
+        .filter(DeviceHistory.timestamp >= start)\
+        .filter(DeviceHistory.timestamp < end)\
+        .order_by(DeviceHistory.device_id, DeviceHistory.timestamp)\
+        .yield_per(fetch_size)
+    for device_id, timestamp, is_online, response_time in rows:
+        yield device_id, {
+            "timestamp": timestamp.strftime(TIME_FORMAT),
+            "online": is_online,
+            "response_time": response_time
+        }
+
+# 把很多小片段合并成约 size 字节的块再输出，减少逐行写 socket 的开销
+def buffered(chunks, size=64 * 1024):
+    buffer = []
+    length = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield "".join(buffer)
+            buffer = []
+            length = 0
+    if buffer:
+        yield "".join(buffer)
+
+# 逐段生成 {"start", "end", "resolution", "devices": {ip: [数据点, ...]}} 的 JSON 文本
+# devices 为 [(device_id, ip)]，没有数据的设备输出空列表
+def stream_timelines(session, devices, start, end, resolution):
+    return buffered(_timeline_chunks(session, devices, start, end, resolution))
+
+def _timeline_chunks(session, devices, start, end, resolution):
+    ips = dict(devices)
+    yield json.dumps({
+        "start": start.strftime(TIME_FORMAT),
+        "end": end.strftime(TIME_FORMAT),
+        "resolution": resolution
+    }, ensure_ascii=False)[:-1] + ', "devices": {'
+
+    written = set()
+    current = None
+    for device_id, point in iter_points(session, list(ips), start, end, resolution):
+        if device_id != current:
+            prefix = "]" if current is not None else ""
+            prefix += ", " if written else ""
+            yield f"{prefix}{json.dumps(ips[device_id])}: [" + json.dumps(point, ensure_ascii=False)
+            written.add(device_id)
+            current = device_id
+        else:
+            yield ", " + json.dumps(point, ensure_ascii=False)
+    if current is not None:
+        yield "]"
+
+    for device_id, ip in devices:
+        if device_id not in written:
+            yield (", " if written else "") + f"{json.dumps(ip)}: []"
+            written.add(device_id)
+    yield "}}"
+
+# 把数据点逐个编码为 json(数组)/ndjson/csv 文本，不在内存中拼出完整结果
+def stream_points(points, fmt="json"):
+    return buffered(_point_chunks(points, fmt))
+
+def _point_chunks(points, fmt):
+    if fmt == "ndjson":
+        for point in points:
+            yield json.dumps(point, ensure_ascii=False) + "\n"
+        return
+
+    if fmt == "csv":
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=CSV_FIELDS, extrasaction="ignore", lineterminator="\n")
+        writer.writeheader()
+        for point in points:
+            writer.writerow(point)
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+        yield out.getvalue()
+        return
+
+    yield "["
+    first = True
+    for point in points:
+        yield ("" if first else ", ") + json.dumps(point, ensure_ascii=False)
+        first = False
+    yield "]"
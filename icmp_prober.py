@@ -0,0 +1,188 @@
+import asyncio
+import heapq
+import itertools
+import os
+import socket
+import struct
+import threading
+import time
+
+# ICMP 报文类型
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+
+# 发包间隔(秒)，大网段可适当调大以免瞬间打满交换机/网卡队列
+ICMP_SEND_INTERVAL = float(os.environ.get('ICMP_SEND_INTERVAL', 0))
+# 套接字接收缓冲区(字节)；大网段的应答集中到达，默认缓冲区只能容纳几百个，多出的会被内核丢弃
+ICMP_RECV_BUFFER = int(os.environ.get('ICMP_RECV_BUFFER', 4 * 1024 * 1024))
+# 连续发送多少个包后让出一次事件循环，及时读取已到达的应答
+SEND_BURST = 64
+
+_seq_counter = itertools.count()
+_seq_lock = threading.Lock()
+
+def _next_seq():
+    with _seq_lock:
+        return next(_seq_counter) & 0xFFFF
+
+# 计算 ICMP 校验和 (RFC 1071)
+def checksum(data):
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+# 构造回显请求报文
+def build_echo_request(ident, seq, payload=b'lan-presence'):
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    csum = checksum(header + payload)
+    return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, csum, ident, seq) + payload
+
+# 解析回显应答，返回 (ident, seq)；不是回显应答则返回 None
+# 原始套接字收到的数据带 IPv4 头，非特权 DGRAM 套接字则不带
+def parse_echo_reply(data):
+    if len(data) >= 20 and data[0] >> 4 == 4:
+        data = data[(data[0] & 0x0F) * 4:]
+    if len(data) < 8:
+        return None
+    icmp_type, _, _, ident, seq = struct.unpack('!BBHHH', data[:8])
+    if icmp_type != ICMP_ECHO_REPLY:
+        return None
+    return ident, seq
+
+# 打开 ICMP 套接字：优先使用非特权 ping 套接字(net.ipv4.ping_group_range)，否则使用原始套接字
+# 两者都不可用时抛出 PermissionError/OSError，由调用方决定是否回退
+def open_icmp_socket():
+    try:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+    except OSError:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+    sock.setblocking(False)
+    if ICMP_RECV_BUFFER:
+        try:
+            # 有 CAP_NET_ADMIN 时可超过 net.core.rmem_max，否则由内核截断到上限
+            sock.setsockopt(socket.SOL_SOCKET, getattr(socket, 'SO_RCVBUFFORCE', socket.SO_RCVBUF), ICMP_RECV_BUFFER)
+        except OSError:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, ICMP_RECV_BUFFER)
+    return sock
+
+# 基于 asyncio 的 ICMP 探测器：整轮扫描共用一个套接字，按 id/序号匹配应答
+class IcmpProber:
+    def __init__(self, sock=None, send_interval=ICMP_SEND_INTERVAL):
+        # sock 可传入测试替身，需提供 fileno()/sendto()/recvfrom()
+        self._sock = sock
+        self.send_interval = send_interval
+        self.ident = os.getpid() & 0xFFFF
+        self.packets_sent = 0
+
+    # plan 为 {ip: (超时秒数, 重试次数)}，未列出的主机使用 timeout/retries
+    # 每个主机按自己的超时独立重发，响应快的主机不必等整轮里最慢的超时
+    async def sweep(self, ips, timeout=1.0, retries=1, plan=None):
+        loop = asyncio.get_running_loop()
+        own_sock = self._sock is None
+        sock = open_icmp_socket() if own_sock else self._sock
+        # DGRAM 套接字的 id 由内核改写为本地端口，内核已按套接字过滤，无需再比对
+        check_ident = getattr(sock, 'type', None) == socket.SOCK_RAW
+
+        results = {ip: None for ip in ips}
+        waiting = set(results)
+        pending = {}  # seq -> (ip, 发送时间)
+        answered = asyncio.Event()
+
+        def on_readable():
+            while True:
+                try:
+                    data, addr = sock.recvfrom(2048)
+                except (BlockingIOError, InterruptedError):
+                    return
+                except OSError:
+                    return
+                received_at = time.perf_counter()
+                reply = parse_echo_reply(data)
+                if reply is None:
+                    continue
+                ident, seq = reply
+                if check_ident and ident != self.ident:
+                    continue
+                entry = pending.get(seq)
+                if entry is None or entry[0] != addr[0]:
+                    continue
+                del pending[seq]
+                ip, sent_at = entry
+                if ip in waiting:
+                    results[ip] = (received_at - sent_at) * 1000  # 毫秒
+                    waiting.discard(ip)
+                    answered.set()
+
+        def host_params(ip):
+            if plan and ip in plan:
+                host_timeout, host_retries = plan[ip]
+                return host_timeout, max(1, host_retries)
+            return timeout, max(1, retries)
+
+        async def send(ip):
+            seq = _next_seq()
+            pending[seq] = (ip, time.perf_counter())
+            await self._send(sock, build_echo_request(self.ident, seq), ip)
+            if self.send_interval:
+                await asyncio.sleep(self.send_interval)
+
+        loop.add_reader(sock.fileno(), on_readable)
+        try:
+            attempts = {}
+            deadlines = []  # (到期时间, ip)
+            for i, ip in enumerate(results):
+                await send(ip)
+                attempts[ip] = 1
+                if not self.send_interval and i % SEND_BURST == SEND_BURST - 1:
+                    await asyncio.sleep(0)
+                heapq.heappush(deadlines, (time.perf_counter() + host_params(ip)[0], ip))
+
+            while deadlines and waiting:
+                if deadlines[0][1] not in waiting:
+                    heapq.heappop(deadlines)
+                    continue
+                remaining = deadlines[0][0] - time.perf_counter()
+                if remaining > 0:
+                    answered.clear()
+                    try:
+                        await asyncio.wait_for(answered.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                _, ip = heapq.heappop(deadlines)
+                host_timeout, host_retries = host_params(ip)
+                if attempts[ip] < host_retries:
+                    await send(ip)
+                    attempts[ip] += 1
+                    heapq.heappush(deadlines, (time.perf_counter() + host_timeout, ip))
+        finally:
+            loop.remove_reader(sock.fileno())
+            if own_sock:
+                sock.close()
+
+        return results
+
+    async def _send(self, sock, packet, ip):
+        # 发送缓冲区满时稍等再试，其他错误(如网络不可达)视为该主机无应答
+        for _ in range(50):
+            try:
+                sock.sendto(packet, (ip, 0))
+                self.packets_sent += 1
+                return True
+            except (BlockingIOError, InterruptedError):
+                await asyncio.sleep(0.001)
+            except OSError:
+                return False
+        return False
+
+# 同步入口：用一个套接字探测一组IP，返回 {ip: 响应时间(ms) 或 None}
+def sweep(ips, timeout=1.0, retries=1, sock=None, plan=None):
+    return asyncio.run(IcmpProber(sock).sweep(list(ips), timeout=timeout, retries=retries, plan=plan))
+
+# 与 network_scanner.is_online 相同的约定：返回 (是否在线, 响应时间ms)
+def is_online(ip, timeout=1, retries=2):
+    response_time = sweep([ip], timeout=timeout, retries=retries).get(ip)
+    return response_time is not None, response_time
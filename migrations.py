@@ -0,0 +1,81 @@
+import logging
+import time
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger('migrations')
+
+# 已有数据库的结构升级：create_all 只会建新表，不会给旧表加列或索引
+# 每个迁移有递增的版本号，执行成功后记录到 schema_migrations 表，之后启动不再执行
+# 迁移函数要能重复执行（新建的库里 create_all 已经建好了列和索引）
+MIGRATIONS = []
+
+_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations', _metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(100)),
+    Column('applied_at', DateTime),
+)
+
+def migration(version, name):
+    def register(func):
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return register
+
+def add_column(conn, table, column, ddl_type):
+    existing = {col['name'] for col in inspect(conn).get_columns(table)}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+def create_index(conn, table, name, columns):
+    existing = {index['name'] for index in inspect(conn).get_indexes(table)}
+    if name not in existing:
+        conn.execute(text(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})"))
+
+@migration(1, 'scan_logs.schedule_lag')
+def _scan_log_schedule_lag(conn):
+    add_column(conn, 'scan_logs', 'schedule_lag', 'FLOAT')
+
+@migration(2, 'device_history(device_id, timestamp), scan_logs 索引')
+def _history_indexes(conn):
+    # 历史查询都是按设备 + 时间范围过滤；/api/status 取 max(scan_logs.timestamp)
+    create_index(conn, 'device_history', 'ix_device_history_device_timestamp', ['device_id', 'timestamp'])
+    create_index(conn, 'scan_logs', 'ix_scan_logs_timestamp', ['timestamp'])
+    create_index(conn, 'scan_logs', 'ix_scan_logs_network_id', ['network_id'])
+
+def applied_versions(engine):
+    schema_migrations.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(select(schema_migrations.c.version))}
+
+# 依次执行尚未执行的迁移，返回本次执行的版本号列表
+def migrate(engine):
+    done = applied_versions(engine)
+    applied = []
+    for version, name, func in MIGRATIONS:
+        if version in done:
+            continue
+        started = time.time()
+        try:
+            with engine.begin() as conn:
+                func(conn)
+                conn.execute(schema_migrations.insert().values(version=version, name=name, applied_at=datetime.now()))
+        except IntegrityError:
+            # 其他进程同时执行了同一个迁移
+            continue
+        applied.append(version)
+        logger.info(f"已执行数据库迁移 {version}: {name} ({time.time() - started:.2f} 秒)")
+    return applied
+
+# python migrations.py 执行迁移并列出各迁移的状态
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    from models import get_engine
+    engine = get_engine()  # 创建引擎时已执行迁移
+    done = applied_versions(engine)
+    for version, name, _ in MIGRATIONS:
+        print(f"{version:>4}  {'已执行' if version in done else '未执行'}  {name}")
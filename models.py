@@ -1,7 +1,12 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, create_engine, func
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Index, create_engine, event, func
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import relationship, sessionmaker
+import logging
 import os
+import re
+import threading
+import migrations
 from datetime import datetime
 
 # 创建基类
@@ -24,6 +29,7 @@ class Device(Base):
     # 关系
     status = relationship("DeviceStatus", back_populates="device", uselist=False, cascade="all, delete-orphan")
     history = relationship("DeviceHistory", back_populates="device", cascade="all, delete-orphan")
+    intervals = relationship("PresenceInterval", back_populates="device", cascade="all, delete-orphan")
     
     def __repr__(self):
         return f"<Device(ip='{self.ip}', name='{self.name}')>"
@@ -50,6 +56,9 @@ class DeviceStatus(Base):
 # 设备历史记录表
 class DeviceHistory(Base):
     __tablename__ = 'device_history'
+    __table_args__ = (
+        Index('ix_device_history_device_timestamp', 'device_id', 'timestamp'),
+    )
     
     id = Column(Integer, primary_key=True)
     device_id = Column(Integer, ForeignKey('devices.id'))
@@ -64,6 +73,51 @@ class DeviceHistory(Base):
         status = "在线" if self.is_online else "离线"
         return f"<DeviceHistory(device='{self.device.ip}', timestamp='{self.timestamp}', status='{status}')>"
 
+# 在线/离线区间表：连续相同状态合并为一条记录，只在状态变化时新增
+class PresenceInterval(Base):
+    __tablename__ = 'presence_intervals'
+    __table_args__ = (
+        Index('ix_presence_intervals_device_start', 'device_id', 'start_time'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    device_id = Column(Integer, ForeignKey('devices.id'), nullable=False)
+    is_online = Column(Boolean, default=False)
+    start_time = Column(DateTime, nullable=False)  # 区间内第一次检测时间
+    end_time = Column(DateTime, nullable=False)  # 区间内最后一次检测时间
+    samples = Column(Integer, default=1)  # 区间内检测次数
+    rtt_avg = Column(Float, nullable=True)  # 平均响应时间(ms)
+    rtt_min = Column(Float, nullable=True)
+    rtt_max = Column(Float, nullable=True)
+    
+    # 关系
+    device = relationship("Device", back_populates="intervals")
+    
+    def __repr__(self):
+        status = "在线" if self.is_online else "离线"
+        return f"<PresenceInterval(device_id={self.device_id}, {self.start_time} ~ {self.end_time}, status='{status}')>"
+
+# 在线情况汇总表：按分钟/小时/天分桶，扫描写入时增量累加
+class PresenceRollup(Base):
+    __tablename__ = 'presence_rollups'
+    __table_args__ = (
+        Index('ix_presence_rollups_key', 'device_id', 'resolution', 'bucket_start', unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    device_id = Column(Integer, ForeignKey('devices.id'), nullable=False)
+    resolution = Column(String(10), nullable=False)  # minute / hour / day
+    bucket_start = Column(DateTime, nullable=False)
+    samples = Column(Integer, default=0)  # 检测次数
+    online_samples = Column(Integer, default=0)  # 其中在线次数
+    rtt_count = Column(Integer, default=0)  # 有响应时间的次数
+    rtt_sum = Column(Float, default=0)
+    rtt_min = Column(Float, nullable=True)
+    rtt_max = Column(Float, nullable=True)
+    
+    def __repr__(self):
+        return f"<PresenceRollup(device_id={self.device_id}, {self.resolution} {self.bucket_start}, {self.online_samples}/{self.samples})>"
+
 # 网段表
 class Network(Base):
     __tablename__ = 'networks'
@@ -84,9 +138,10 @@ class ScanLog(Base):
     __tablename__ = 'scan_logs'
     
     id = Column(Integer, primary_key=True)
-    timestamp = Column(DateTime, default=datetime.now)
-    network_id = Column(Integer, ForeignKey('networks.id'), nullable=True)
+    timestamp = Column(DateTime, default=datetime.now, index=True)
+    network_id = Column(Integer, ForeignKey('networks.id'), nullable=True, index=True)
     duration = Column(Float, nullable=True)  # 扫描用时(秒)
+    schedule_lag = Column(Float, nullable=True)  # 实际开始时间比计划晚了多少(秒)
     devices_total = Column(Integer, default=0)
     devices_online = Column(Integer, default=0)
     error_message = Column(String(255), nullable=True)
@@ -94,18 +149,86 @@ class ScanLog(Base):
     def __repr__(self):
         return f"<ScanLog(timestamp='{self.timestamp}', devices_online={self.devices_online})>"
 
+# 连接池配置（对 SQLite 内存库无效）
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))  # 等待空闲连接的秒数
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 3600))  # 连接最长复用秒数，-1 不回收
+
+# SQLite 每个连接建立时执行的 PRAGMA：默认 WAL + synchronous=NORMAL，扫描写入时读请求不再被阻塞
+# SQLITE_PROFILE=off 保持 SQLite 默认设置；单项设为空则不修改该项
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'wal').lower()
+SQLITE_PRAGMAS = [
+    ('journal_mode', os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')),
+    ('synchronous', os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+    ('busy_timeout', os.environ.get('SQLITE_BUSY_TIMEOUT', '5000')),  # 等锁的毫秒数
+    ('cache_size', os.environ.get('SQLITE_CACHE_SIZE', '-20000')),  # 负数表示 KB
+    ('mmap_size', os.environ.get('SQLITE_MMAP_SIZE', '268435456')),
+    ('temp_store', os.environ.get('SQLITE_TEMP_STORE', 'MEMORY')),
+]
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS:
+            if not value:
+                continue
+            if not re.fullmatch(r'-?\w+', value):
+                logging.getLogger('models').warning(f"忽略无效的 SQLite 设置 {name}={value}")
+                continue
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+# 进程内共享的引擎和会话工厂，首次使用时创建
+_engine = None
+_session_factory = None
+_engine_lock = threading.Lock()
+
+def _engine_options(db_url):
+    url = make_url(db_url)
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
+
+# 获取共享引擎，表结构只在创建引擎时检查一次
+def get_engine():
+    global _engine, _session_factory
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                # 默认使用SQLite，可通过环境变量配置
+                db_url = os.environ.get('DATABASE_URL', 'sqlite:///presence.db')
+                engine = create_engine(db_url, **_engine_options(db_url))
+                if engine.dialect.name == 'sqlite' and SQLITE_PROFILE != 'off':
+                    event.listen(engine, 'connect', _apply_sqlite_pragmas)
+                Base.metadata.create_all(engine)
+                # 旧库补上后来新增的列和索引
+                migrations.migrate(engine)
+                _session_factory = sessionmaker(bind=engine)
+                _engine = engine
+    return _engine
+
+# 释放连接池，下次使用时按当前 DATABASE_URL 重新创建（子进程或切换数据库时调用）
+def dispose_engine():
+    global _engine, _session_factory
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+        _engine = None
+        _session_factory = None
+
 # 数据库连接
 def get_db_session():
-    # 默认使用SQLite，可通过环境变量配置
-    db_url = os.environ.get('DATABASE_URL', 'sqlite:///presence.db')
-    engine = create_engine(db_url)
-    Base.metadata.create_all(engine)
-    Session = sessionmaker(bind=engine)
-    return Session()
+    get_engine()
+    return _session_factory()
 
 # 初始化数据库
 def init_db():
-    db_url = os.environ.get('DATABASE_URL', 'sqlite:///presence.db')
-    engine = create_engine(db_url)
-    Base.metadata.create_all(engine)
-    return engine
\ No newline at end of file
+    return get_engine()
@@ -0,0 +1,281 @@
+import fcntl
+import ipaddress
+import logging
+import os
+import select
+import socket
+import struct
+import time
+from collections import namedtuple
+
+logger = logging.getLogger('neighbor_table')
+
+# 邻居表(ARP)发现：off 关闭 / table 读取内核邻居表 / arping 同时对整个网段发送一轮 ARP 请求
+NEIGHBOR_DISCOVERY = os.environ.get('NEIGHBOR_DISCOVERY', 'table').strip().lower()
+# 指定时从该文件读取邻居表（测试用样例文件），支持 `ip neigh show` 的输出（带 REACHABLE/STALE 等状态）
+# 和 /proc/net/arp 格式（没有状态，只提供 MAC）；默认通过 netlink 读取，失败时读 /proc/net/arp
+ARP_TABLE_PATH = os.environ.get('ARP_TABLE_PATH', '')
+PROC_ARP_PATH = '/proc/net/arp'
+# 发送 ARP 请求的网卡，留空时按路由表选择
+ARP_INTERFACE = os.environ.get('ARP_INTERFACE', '')
+ARP_TIMEOUT = float(os.environ.get('ARP_TIMEOUT', 1.0))
+
+# state 为内核邻居状态(NUD_*)；从 /proc/net/arp 格式读取时没有状态，为 None
+Neighbor = namedtuple('Neighbor', ['ip', 'mac', 'state'])
+
+NUD_INCOMPLETE = 0x01
+NUD_REACHABLE = 0x02
+NUD_STALE = 0x04
+NUD_DELAY = 0x08
+NUD_PROBE = 0x10
+NUD_FAILED = 0x20
+NUD_NOARP = 0x40
+NUD_PERMANENT = 0x80
+
+# `ip neigh show` 输出中的状态名
+NUD_NAMES = {
+    'INCOMPLETE': NUD_INCOMPLETE, 'REACHABLE': NUD_REACHABLE, 'STALE': NUD_STALE, 'DELAY': NUD_DELAY,
+    'PROBE': NUD_PROBE, 'FAILED': NUD_FAILED, 'NOARP': NUD_NOARP, 'PERMANENT': NUD_PERMANENT,
+}
+
+ATF_COM = 0x02  # /proc/net/arp 中表示已解析出 MAC
+PROC_ARP_HEADER = 'IP address'
+EMPTY_MAC = '00:00:00:00:00:00'
+
+def enabled():
+    return NEIGHBOR_DISCOVERY in ('table', 'arping')
+
+# 解析 /proc/net/arp 格式的文本，返回 {ip: Neighbor}，只保留已解析出 MAC 的条目
+def parse_proc_arp(text):
+    neighbors = {}
+    for line in text.splitlines()[1:]:
+        fields = line.split()
+        if len(fields) < 6:
+            continue
+        ip, _, flags, mac = fields[:4]
+        try:
+            flags = int(flags, 16)
+        except ValueError:
+            continue
+        if flags & ATF_COM and mac != EMPTY_MAC:
+            neighbors[ip] = Neighbor(ip, mac.lower(), None)
+    return neighbors
+
+def read_proc_arp(path=PROC_ARP_PATH):
+    with open(path, 'r') as f:
+        return parse_proc_arp(f.read())
+
+# 解析 `ip -4 neigh show` 的输出，返回 {ip: Neighbor}，只保留有 MAC 的条目，例如：
+#   192.168.1.10 dev eth0 lladdr aa:bb:cc:dd:ee:ff REACHABLE
+def parse_ip_neigh(text):
+    neighbors = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if not fields or 'lladdr' not in fields:
+            continue
+        index = fields.index('lladdr')
+        if index + 1 >= len(fields):
+            continue
+        ip, mac = fields[0], fields[index + 1].lower()
+        state = 0
+        for field in fields[index + 2:]:
+            state |= NUD_NAMES.get(field, 0)
+        if mac != EMPTY_MAC:
+            neighbors[ip] = Neighbor(ip, mac, state)
+    return neighbors
+
+# 读取邻居表样例文件，按第一行判断是 /proc/net/arp 格式还是 `ip neigh show` 的输出
+def read_table_file(path):
+    with open(path, 'r') as f:
+        text = f.read()
+    if text.lstrip().startswith(PROC_ARP_HEADER):
+        return parse_proc_arp(text)
+    return parse_ip_neigh(text)
+
+# 通过 netlink (RTM_GETNEIGH) 读取 IPv4 邻居表，带邻居状态
+def read_netlink():
+    RTM_NEWNEIGH, RTM_GETNEIGH = 28, 30
+    NLMSG_ERROR, NLMSG_DONE = 2, 3
+    NLM_F_REQUEST, NLM_F_DUMP = 0x1, 0x300
+    NDA_DST, NDA_LLADDR = 1, 2
+
+    ndmsg = struct.pack('BBHiHBB', socket.AF_INET, 0, 0, 0, 0, 0, 0)
+    request = struct.pack('IHHII', 16 + len(ndmsg), RTM_GETNEIGH, NLM_F_REQUEST | NLM_F_DUMP, 1, 0) + ndmsg
+
+    neighbors = {}
+    with socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, 0) as sock:
+        sock.settimeout(1.0)
+        sock.send(request)
+        while True:
+            data = sock.recv(65536)
+            offset = 0
+            while offset + 16 <= len(data):
+                length, msg_type, _, _, _ = struct.unpack_from('IHHII', data, offset)
+                if length < 16:
+                    return neighbors
+                if msg_type == NLMSG_DONE:
+                    return neighbors
+                if msg_type == NLMSG_ERROR:
+                    raise OSError("netlink 返回错误")
+                if msg_type == RTM_NEWNEIGH:
+                    _, _, _, _, state, _, _ = struct.unpack_from('BBHiHBB', data, offset + 16)
+                    ip = mac = None
+                    attr = offset + 28
+                    while attr + 4 <= offset + length:
+                        attr_len, attr_type = struct.unpack_from('HH', data, attr)
+                        if attr_len < 4:
+                            break
+                        value = data[attr + 4:attr + attr_len]
+                        if attr_type == NDA_DST and len(value) == 4:
+                            ip = socket.inet_ntoa(value)
+                        elif attr_type == NDA_LLADDR and len(value) == 6:
+                            mac = ':'.join(f'{b:02x}' for b in value)
+                        attr += (attr_len + 3) & ~3
+                    if ip and mac and mac != EMPTY_MAC:
+                        neighbors[ip] = Neighbor(ip, mac, state)
+                offset += (length + 3) & ~3
+
+# 读取邻居表：指定了 path 时读该文件，否则优先 netlink，不可用时读 /proc/net/arp
+def read_neighbors(path=None):
+    path = path or ARP_TABLE_PATH
+    if path:
+        return read_table_file(path)
+    try:
+        return read_netlink()
+    except OSError as e:
+        logger.debug(f"netlink 读取邻居表失败({str(e)})，改读 {PROC_ARP_PATH}")
+    try:
+        return read_proc_arp(PROC_ARP_PATH)
+    except OSError:
+        return {}
+
+# 邻居条目能否说明主机此刻在线：netlink 条目要求 REACHABLE（最近确认过）；
+# /proc/net/arp 没有状态信息，条目可能是主机离开后仍缓存着的，只用来补全 MAC，主机照常探测
+def is_present(neighbor):
+    if neighbor.state is None:
+        return False
+    return bool(neighbor.state & NUD_REACHABLE)
+
+# 路由表中覆盖该网段的网卡
+def _interface_for(network):
+    try:
+        with open('/proc/net/route') as f:
+            lines = f.read().splitlines()[1:]
+    except OSError:
+        return None
+    best = None
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 8:
+            continue
+        destination = socket.inet_ntoa(struct.pack('<I', int(fields[1], 16)))
+        mask = socket.inet_ntoa(struct.pack('<I', int(fields[7], 16)))
+        route = ipaddress.ip_network(f"{destination}/{mask}", strict=False)
+        if route.prefixlen and network.subnet_of(route) and (best is None or route.prefixlen > best[1]):
+            best = (fields[0], route.prefixlen)
+    return best[0] if best else None
+
+def _interface_addresses(interface):
+    SIOCGIFADDR, SIOCGIFHWADDR = 0x8915, 0x8927
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        request = struct.pack('256s', interface.encode()[:15])
+        ip = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)[20:24]
+        mac = fcntl.ioctl(sock.fileno(), SIOCGIFHWADDR, request)[18:24]
+    return ip, mac
+
+# 对一组同网段IP各发一个 ARP 请求，在 timeout 内收集应答，返回 {ip: (mac, 响应时间ms)}
+# 需要 Linux AF_PACKET 原始套接字（root 或 CAP_NET_RAW）
+def arp_sweep(ips, interface=None, timeout=ARP_TIMEOUT):
+    ips = list(ips)
+    if not ips:
+        return {}
+    interface = interface or ARP_INTERFACE or _interface_for(ipaddress.ip_network(f"{ips[0]}/24", strict=False))
+    if not interface:
+        raise OSError(f"找不到 {ips[0]} 所在网段的网卡")
+    src_ip, src_mac = _interface_addresses(interface)
+
+    wanted = set(ips)
+    sent = {}
+    found = {}
+
+    # 读取一个已到达的帧，是所需主机的 ARP 应答时记入 found
+    def receive(sock):
+        try:
+            frame = sock.recv(2048)
+        except BlockingIOError:
+            return
+        if len(frame) < 42 or frame[12:14] != b'\x08\x06':
+            return
+        if struct.unpack('!H', frame[20:22])[0] != 2:  # 只要 ARP 应答
+            return
+        sender_ip = socket.inet_ntoa(frame[28:32])
+        if sender_ip in sent and sender_ip not in found:
+            mac = ':'.join(f'{b:02x}' for b in frame[22:28])
+            found[sender_ip] = (mac, (time.time() - sent[sender_ip]) * 1000)
+
+    with socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(0x0806)) as sock:
+        sock.bind((interface, 0))
+        sock.setblocking(False)
+        for ip in ips:
+            frame = (
+                b'\xff' * 6 + src_mac + struct.pack('!H', 0x0806)
+                + struct.pack('!HHBBH', 1, 0x0800, 6, 4, 1)
+                + src_mac + src_ip + b'\x00' * 6 + socket.inet_aton(ip)
+            )
+            while True:
+                try:
+                    sock.send(frame)
+                    sent[ip] = time.time()
+                    break
+                except BlockingIOError:
+                    # 大网段一次发不完：发送缓冲区满时等待可写，同时读取已到达的应答，避免接收缓冲区溢出
+                    readable, writable, _ = select.select([sock], [sock], [], timeout)
+                    if readable:
+                        receive(sock)
+                    elif not writable:
+                        raise OSError(f"发送 ARP 请求超时，已发送 {len(sent)}/{len(ips)}")
+
+        deadline = time.time() + timeout
+        while len(found) < len(wanted):
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([sock], [], [], remaining)[0]:
+                break
+            receive(sock)
+    return found
+
+# 扫描前的发现阶段，返回 (在线主机 {ip: 响应时间ms 或 None}, MAC {ip: mac})
+# 在线主机无需再做 ICMP 探测；MAC 包含邻居表中所有已知条目，用于补全 Device.mac_address
+def discover(ips, mode=None, path=None):
+    mode = mode or NEIGHBOR_DISCOVERY
+    if mode not in ('table', 'arping'):
+        return {}, {}
+    wanted = set(ips)
+    present = {}
+    macs = {}
+
+    if mode == 'arping':
+        try:
+            for ip, (mac, response_time) in arp_sweep(ips).items():
+                present[ip] = response_time
+                macs[ip] = mac
+        except OSError as e:
+            logger.warning(f"发送 ARP 请求失败({str(e)})，只读取邻居表")
+
+    for ip, neighbor in read_neighbors(path).items():
+        if ip not in wanted:
+            continue
+        macs.setdefault(ip, neighbor.mac)
+        if ip not in present and is_present(neighbor):
+            present[ip] = None
+    return present, macs
+
+# ICMP 没有回应、但探测时内核 ARP 解析成功的主机（不回 ping 的手机等），返回 {ip: mac}
+# 需要带状态的邻居表(netlink)；只能读 /proc/net/arp 时不确认任何主机
+def confirm_silent(ips, path=None):
+    wanted = set(ips)
+    if not wanted:
+        return {}
+    return {
+        ip: neighbor.mac for ip, neighbor in read_neighbors(path).items()
+        if ip in wanted and is_present(neighbor)
+    }
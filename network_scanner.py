@@ -1,12 +1,22 @@
 import ipaddress
 import time
-import threading
 import os
 import logging
-from datetime import datetime, timedelta
-from ping3 import ping
-import subprocess
+from datetime import datetime
 import socket
+import db_writer
+import history_log
+import neighbor_table
+import presence_events
+import presence_snapshot
+import presence_state
+import probe_schedule
+import probe_strategy
+import rtt_estimator
+import retention
+import scan_pool
+import scan_scheduler
+import scan_writer
 from models import Device, DeviceStatus, DeviceHistory, Network, ScanLog, get_db_session
 from dotenv import load_dotenv
 
@@ -26,45 +36,12 @@ logger = logging.getLogger('network_scanner')
 SCAN_INTERVAL = int(os.environ.get('SCAN_INTERVAL', 30))
 HISTORY_RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', 30))
 NETWORK_SEGMENTS = os.environ.get('NETWORK_SEGMENTS', '192.168.1.0/24').split(',')
+SCAN_WORKERS = int(os.environ.get('SCAN_WORKERS', 64))  # 同时在途的探测数上限，1 即逐个扫描
 
-# 尝试通过 ping 判断 IP 是否在线
+# 尝试通过 ping 判断 IP 是否在线，返回 (是否在线, 响应时间ms)
+# 具体使用哪种探测方式由 probe_strategy 在启动时检测并缓存
 def is_online(ip, timeout=1, retries=2):
-    response_time = None
-    
-    # 尝试使用ping3库
-    for _ in range(retries):
-        try:
-            result = ping(ip, timeout=timeout)
-            if result is not None and result is not False:
-                response_time = result * 1000  # 转换为毫秒
-                return True, response_time
-        except Exception:
-            pass
-    
-    # 如果ping3失败，尝试使用系统ping命令
-    ping_params = []
-    if os.name == 'nt':  # Windows
-        ping_params = ["ping", "-n", "1", "-w", str(int(timeout * 1000)), ip]
-    else:  # Linux/Mac
-        ping_params = ["ping", "-c", "1", "-W", str(timeout), ip]
-    
-    for _ in range(retries):
-        try:
-            start_time = time.time()
-            res = subprocess.run(
-                ping_params,
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                text=True
-            )
-            end_time = time.time()
-            
-            if res.returncode == 0:
-                response_time = (end_time - start_time) * 1000  # 转换为毫秒
-                return True, response_time
-        except Exception:
-            pass
-    
-    return False, None
+    return probe_strategy.is_online(ip, timeout=timeout, retries=retries)
 
 # 尝试获取主机名
 def get_hostname(ip, timeout=1):
@@ -73,217 +50,179 @@ def get_hostname(ip, timeout=1):
     except:
         return None
 
-# 扫描单个网段
-def scan_network(network_cidr, session=None):
-    if session is None:
-        session = get_db_session()
-    
-    # 查找或创建网络记录
+# 并发探测一组IP，返回 {ip: 响应时间ms 或 None}，顺序与输入一致
+# plan 为各主机的 (超时, 重试次数)，未列出的主机使用 timeout/retries
+# 启用 SCAN_PROCESSES 时地址分片交给探测子进程并行探测
+def probe_hosts(ips, timeout=1.5, retries=2, workers=SCAN_WORKERS, plan=None):
+    if scan_pool.enabled():
+        return scan_pool.sweep(ips, timeout=timeout, retries=retries, workers=workers, plan=plan)
+    return probe_strategy.sweep(ips, timeout=timeout, retries=retries, workers=workers, plan=plan)
+
+# 查找或创建网络记录，并新建本次扫描的日志，返回 (network_id, scan_log_id)
+def _start_scan_log(session, network_cidr, schedule_lag):
     network = session.query(Network).filter_by(cidr=network_cidr).first()
     if not network:
         network = Network(name=f"网段 {network_cidr}", cidr=network_cidr)
         session.add(network)
-        session.commit()
-    
-    # 创建扫描日志
-    scan_log = ScanLog(network_id=network.id, timestamp=datetime.now())
+        session.flush()
+    scan_log = ScanLog(network_id=network.id, timestamp=datetime.now(), schedule_lag=schedule_lag)
     session.add(scan_log)
-    
+    session.flush()
+    return network.id, scan_log.id
+
+def _finish_scan_log(session, network_id, scan_log_id, duration, devices_total, devices_online, errors):
+    values = {'duration': duration, 'devices_total': devices_total, 'devices_online': devices_online}
+    if errors:
+        values['error_message'] = '; '.join(errors[:3]) + ('...' if len(errors) > 3 else '')
+    session.query(ScanLog).filter_by(id=scan_log_id).update(values, synchronize_session=False)
+    # 更新网络最后扫描时间
+    session.query(Network).filter_by(id=network_id).update({'last_scan': datetime.now()}, synchronize_session=False)
+
+# 加载网段内已知设备的状态，用于决定本轮探测哪些地址
+def _load_known(ips):
+    session = get_db_session()
+    try:
+        return scan_writer.load_known_devices(session, ips)
+    finally:
+        session.close()
+
+# 新发现的在线IP先在扫描线程里解析主机名，避免在写事务中等待 DNS
+def _resolve_new_hostnames(probe_results, known, present=()):
+    return {
+        ip: get_hostname(ip) for ip, response_time in probe_results.items()
+        if (response_time is not None or ip in present) and ip not in known
+    }
+
+# 扫描单个网段
+# schedule_lag 为调度器记录的实际开始时间相对计划时间的延迟(秒)
+# 探测期间不占用数据库；所有写入经 db_writer 排队，由单个写线程执行
+def scan_network(network_cidr, workers=SCAN_WORKERS, schedule_lag=None):
     start_time = time.time()
     devices_total = 0
     devices_online = 0
+    probed = 0
     errors = []
+    changes = []
+    
+    # 创建扫描日志
+    network_id, scan_log_id = db_writer.run(lambda session: _start_scan_log(session, network_cidr, schedule_lag))
     
     try:
         # 解析网段
         network_obj = ipaddress.ip_network(network_cidr)
         devices_total = network_obj.num_addresses - 2  # 减去网络地址和广播地址
         
-        # 更新扫描日志
-        scan_log.devices_total = devices_total
-        session.commit()
+        ips = [str(ip) for ip in network_obj.hosts()]
+        known = _load_known(ips)
+        schedule = probe_schedule.get_schedule()
         
-        # 扫描每个IP
-        for ip in network_obj.hosts():
-            ip_str = str(ip)
-            
-            try:
-                # 检查设备是否在线
-                online, response_time = is_online(ip_str, timeout=1.5, retries=2)
-                
-                # 查找或创建设备记录
-                device = session.query(Device).filter_by(ip=ip_str).first()
-                if online:
-                    # 设备在线
-                    devices_online += 1
-                    now = datetime.now()
-                    
-                    if not device:
-                        # 新设备，尝试获取主机名
-                        hostname = get_hostname(ip_str)
-                        device = Device(ip=ip_str, hostname=hostname, first_seen=now)
-                        session.add(device)
-                        session.flush()  # 获取ID但不提交
-                    
-                    # 更新或创建设备状态
-                    status = session.query(DeviceStatus).filter_by(device_id=device.id).first()
-                    if not status:
-                        status = DeviceStatus(device_id=device.id, is_online=True, last_seen=now, start_time=now, response_time=response_time, last_check=now)
-                        session.add(status)
-                    else:
-                        # 如果设备之前离线，现在上线，更新开始时间
-                        if not status.is_online:
-                            status.start_time = now
-                            logger.info(f"设备上线: {ip_str} ({device.name or device.hostname or '未知设备'})")
-                        
-                        status.is_online = True
-                        status.last_seen = now
-                        status.response_time = response_time
-                        status.last_check = now
-                    
-                    # 添加历史记录
-                    history = DeviceHistory(device_id=device.id, timestamp=now, is_online=True, response_time=response_time)
-                    session.add(history)
-                else:
-                    # 设备离线
-                    if device:
-                        # 更新设备状态
-                        status = session.query(DeviceStatus).filter_by(device_id=device.id).first()
-                        if status:
-                            # 如果设备之前在线，现在离线，记录日志
-                            if status.is_online:
-                                logger.info(f"设备离线: {ip_str} ({device.name or device.hostname or '未知设备'})")
-                            
-                            status.is_online = False
-                            status.last_check = datetime.now()
-                            
-                            # 添加历史记录
-                            history = DeviceHistory(device_id=device.id, timestamp=datetime.now(), is_online=False)
-                            session.add(history)
-                
-                # 每10个IP提交一次，减少数据库压力
-                if devices_online % 10 == 0:
-                    session.commit()
-                    
-            except Exception as e:
-                errors.append(f"{ip_str}: {str(e)}")
-                logger.warning(f"扫描IP {ip_str} 时出错: {str(e)}")
+        # 先查邻居表(ARP)：已确认在线的主机不再发 ICMP；其余地址由 probe_schedule 决定本轮是否探测
+        present, macs = neighbor_table.discover(ips)
+        due = set(schedule.plan([ip for ip in ips if ip not in present], known))
+        probe_results = {ip: present.get(ip) for ip in ips if ip in present or ip in due}
+        probed = len(due)
+        # 每台主机的超时和重试次数按其响应时间估算，没有记录的主机使用固定的 1.5 秒 × 2 次
+        estimator = rtt_estimator.get_estimator()
+        estimator.seed(known)
         
-        # 提交所有更改
-        session.commit()
+        def probe(targets):
+            found = probe_hosts(targets, timeout=1.5, retries=2, workers=workers, plan=estimator.plan(targets))
+            estimator.observe(found)
+            return found
+        
+        probe_results.update(probe([ip for ip in ips if ip in due]))
+        # 不回 ping 但在探测期间 ARP 解析成功的主机同样算在线
+        if neighbor_table.enabled():
+            silent = neighbor_table.confirm_silent(ip for ip in due if probe_results[ip] is None)
+            for ip, mac in silent.items():
+                present[ip] = None
+                macs.setdefault(ip, mac)
+        
+        # 在线设备漏掉探测时先标为 suspect 并立即重探测，确认离线后才写库；suspect 主机本轮不写入
+        states = presence_state.settle(
+            presence_state.get_tracker(), probe_results,
+            lambda ip: ip in known and bool(known[ip].is_online), probe, online=present
+        )
+        schedule.record(probe_results, known, present)
+        held = sum(1 for state in states.values() if state == presence_state.SUSPECT)
+        probe_results = {ip: rtt for ip, rtt in probe_results.items() if states.get(ip) != presence_state.SUSPECT}
+        hostnames = _resolve_new_hostnames(probe_results, known, present)
+        
+        # 整段结果一次加载、内存比对、批量写入，与扫描日志在同一事务中提交
+        def write(session):
+            changes.clear()
+            online = scan_writer.write_scan_results(
+                session, probe_results, resolve_hostname=hostnames.get, changes=changes,
+                present=present, macs=macs
+            ) + held
+            _finish_scan_log(session, network_id, scan_log_id, time.time() - start_time, devices_total, online, [])
+            return online
+        devices_online = db_writer.run(write)
         
     except Exception as e:
+        changes = []
         errors.append(f"扫描网段 {network_cidr} 失败: {str(e)}")
         logger.error(f"扫描网段 {network_cidr} 失败: {str(e)}")
+        db_writer.run(lambda session: _finish_scan_log(
+            session, network_id, scan_log_id, time.time() - start_time, devices_total, 0, errors
+        ))
     
-    # 更新扫描日志
-    end_time = time.time()
-    scan_duration = end_time - start_time
+    scan_duration = time.time() - start_time
     
-    scan_log.duration = scan_duration
-    scan_log.devices_online = devices_online
-    if errors:
-        scan_log.error_message = '; '.join(errors[:3]) + ('...' if len(errors) > 3 else '')
-    
-    # 更新网络最后扫描时间
-    network.last_scan = datetime.now()
+    # 提交后先发布新的状态快照（供 /api/status 直接返回），再推送上线/离线/响应时间变化，
+    # 保证客户端收到事件后拉到的快照不会比事件旧
+    presence_snapshot.publish_quietly()
+    for kind, data in changes:
+        presence_events.emit(kind, data)
     
-    session.commit()
-    
-    logger.info(f"扫描完成: 网段 {network_cidr}, 总设备 {devices_total}, 在线 {devices_online}, 用时 {scan_duration:.2f}秒")
+    logger.info(f"扫描完成: 网段 {network_cidr}, 总设备 {devices_total}, 探测 {probed}, 在线 {devices_online}, 用时 {scan_duration:.2f}秒")
     
     if errors:
         logger.warning(f"扫描过程中有{len(errors)}个错误: {', '.join(errors[:3])}{'...' if len(errors) > 3 else ''}")
     
     return devices_online
 
-# 清理历史数据
+# 清理历史数据：立即执行一次分批清理（平时由 retention 后台线程按自己的间隔执行）
 def cleanup_history():
-    session = get_db_session()
-    try:
-        cutoff_date = datetime.now() - timedelta(days=HISTORY_RETENTION_DAYS)
-        deleted = session.query(DeviceHistory).filter(DeviceHistory.timestamp < cutoff_date).delete()
-        session.commit()
-        if deleted > 0:
-            logger.info(f"已清理 {deleted} 条历史记录 (超过 {HISTORY_RETENTION_DAYS} 天)")
-    except Exception as e:
-        logger.error(f"清理历史记录失败: {str(e)}")
-        session.rollback()
-    finally:
-        session.close()
+    return retention.run_once()
 
-# 扫描所有配置的网段
+# 立即扫描所有启用的网段（/api/scan），返回在线设备总数
+# 调度器已启动时交给它的线程池执行并等待完成，正在扫描的网段不重复提交；未启动时在当前线程依次扫描
 def scan_all_networks():
+    if _scheduler is not None:
+        futures = _scheduler.scan_all()
+        return sum(future.result() or 0 for future in futures)
+
     session = get_db_session()
-    total_online = 0
-    
     try:
-        # 扫描每个网段
-        for network_cidr in NETWORK_SEGMENTS:
-            network_cidr = network_cidr.strip()
-            if network_cidr:
-                try:
-                    online_count = scan_network(network_cidr, session)
-                    total_online += online_count
-                except Exception as e:
-                    logger.error(f"扫描网段 {network_cidr} 时出错: {str(e)}")
-        
-        # 每天清理一次历史数据
-        if datetime.now().hour == 3:  # 凌晨3点
-            cleanup_history()
-            
-    except Exception as e:
-        logger.error(f"扫描过程中发生错误: {str(e)}")
+        cidrs = [cidr for cidr, in session.query(Network.cidr).filter(Network.is_active == True).all()]
     finally:
         session.close()
-    
+
+    total_online = 0
+    for network_cidr in cidrs:
+        try:
+            total_online += scan_network(network_cidr)
+        except Exception as e:
+            logger.error(f"扫描网段 {network_cidr} 时出错: {str(e)}")
     return total_online
 
-# 启动扫描循环
-def start_scan_loop(interval=SCAN_INTERVAL):
-    def loop():
-        consecutive_errors = 0
-        last_success = time.time()
-        
-        while True:
-            try:
-                start_time = time.time()
-                total_online = scan_all_networks()
-                end_time = time.time()
-                
-                scan_duration = end_time - start_time
-                logger.info(f"全网扫描完成: 在线设备 {total_online}, 用时 {scan_duration:.2f}秒")
-                
-                # 重置错误计数
-                consecutive_errors = 0
-                last_success = time.time()
-                
-            except Exception as e:
-                consecutive_errors += 1
-                logger.error(f"扫描错误 ({consecutive_errors}连续): {str(e)}")
-                
-                # 如果连续错误过多且间隔时间较长，尝试恢复
-                if consecutive_errors >= 5 and time.time() - last_success > 300:  # 5分钟
-                    logger.warning(f"检测到连续{consecutive_errors}次错误，尝试恢复...")
-                    try:
-                        # 尝试重新连接数据库
-                        session = get_db_session()
-                        session.execute("SELECT 1")
-                        session.close()
-                        logger.info("数据库连接检查正常")
-                    except Exception as recovery_error:
-                        logger.error(f"恢复尝试失败: {str(recovery_error)}")
-            
-            # 动态调整扫描间隔
-            actual_interval = interval
-            if consecutive_errors > 0:
-                # 出错时略微增加间隔
-                actual_interval = min(interval * 1.5, 120)  # 最多2分钟
-            
-            time.sleep(actual_interval)
-    
-    logger.info(f"启动网络扫描线程，间隔 {interval} 秒")
-    threading.Thread(target=loop, daemon=True, name="NetworkScanner").start()
+_scheduler = None
+
+def _scheduled_scan(network_cidr, schedule_lag):
+    return scan_network(network_cidr, schedule_lag=schedule_lag)
+
+# 启动按网段独立调度的扫描：每个启用的 Network 按自己的 scan_interval 扫描
+def start_scheduler(interval=SCAN_INTERVAL):
+    global _scheduler
+    if scan_pool.in_worker():
+        return None
+    if _scheduler is None:
+        _scheduler = scan_scheduler.NetworkScheduler(_scheduled_scan, default_interval=interval).start()
+    return _scheduler
+
+def get_scheduler():
+    return _scheduler
 
 # 导入旧数据到数据库
 def import_legacy_data():
@@ -342,10 +281,9 @@ def import_legacy_data():
         logger.info(f"已导入 {len(status_data)} 个设备状态信息")
         
         # 导入历史记录
-        history_data = load_json("history.json")
         history_count = 0
         
-        for entry in history_data:
+        for entry in history_log.read_since(None):
             timestamp = datetime.strptime(entry.get("timestamp", ""), "%Y-%m-%d %H:%M:%S")
             online_ips = entry.get("online", [])
             
@@ -417,8 +355,9 @@ def main():
     # 导入旧数据
     import_legacy_data()
     
-    # 启动扫描
-    start_scan_loop()
+    # 启动扫描和历史数据清理
+    start_scheduler()
+    retention.start()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
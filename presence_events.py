@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+# 内存中保留的最近事件数，断线重连的客户端可补发这些事件
+EVENT_BUFFER_SIZE = int(os.environ.get('EVENT_BUFFER_SIZE', 1000))
+# 没有事件时发送注释行保活的间隔(秒)，避免代理断开空闲连接
+EVENT_HEARTBEAT = int(os.environ.get('EVENT_HEARTBEAT', 15))
+
+# 进程启动标识，重启后旧的事件 id 失效，客户端需要重新拉取完整状态
+BOOT_ID = uuid.uuid4().hex[:8]
+
+_events = deque(maxlen=EVENT_BUFFER_SIZE)  # (seq, 类型, 数据)
+_seq = 0
+_condition = threading.Condition()
+
+# 发布一个事件，返回事件序号
+def emit(kind, data):
+    global _seq
+    with _condition:
+        _seq += 1
+        _events.append((_seq, kind, data))
+        _condition.notify_all()
+        return _seq
+
+def _parse_event_id(event_id):
+    # 事件 id 形如 "<BOOT_ID>:<序号>"；不是本进程发出的 id 返回 None
+    if not event_id or ':' not in event_id:
+        return None
+    boot_id, _, seq = event_id.partition(':')
+    if boot_id != BOOT_ID or not seq.isdigit():
+        return None
+    return int(seq)
+
+# 取出序号大于 after 的事件；after 早于缓冲区能覆盖的范围时返回 None，表示有事件已丢失
+def events_since(after):
+    with _condition:
+        if _events and after < _events[0][0] - 1:
+            return None
+        return [event for event in _events if event[0] > after]
+
+def current_seq():
+    with _condition:
+        return _seq
+
+def _format(seq, kind, data):
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"id: {BOOT_ID}:{seq}\nevent: {kind}\ndata: {payload}\n\n"
+
+# SSE 事件流生成器；last_event_id 为客户端的 Last-Event-ID，可补发断线期间的事件
+def stream(last_event_id=None, heartbeat=EVENT_HEARTBEAT):
+    # 断线重连时间(毫秒)
+    yield "retry: 3000\n\n"
+
+    after = _parse_event_id(last_event_id)
+    if after is None or events_since(after) is None:
+        # 首次连接、服务重启或缺口太大：让客户端先拉一次完整状态，之后只推送增量
+        after = current_seq()
+        yield _format(after, "reset", {"reason": "resync"})
+
+    while True:
+        with _condition:
+            if _seq <= after:
+                _condition.wait(timeout=heartbeat)
+        pending = events_since(after)
+        if pending is None:
+            after = current_seq()
+            yield _format(after, "reset", {"reason": "overflow"})
+            continue
+        if not pending:
+            yield f": keepalive {int(time.time())}\n\n"
+            continue
+        for seq, kind, data in pending:
+            yield _format(seq, kind, data)
+            after = seq
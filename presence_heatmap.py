@@ -0,0 +1,177 @@
+import base64
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from models import DeviceHistory, PresenceInterval, PresenceRollup
+import presence_intervals
+
+logger = logging.getLogger('presence_heatmap')
+
+MINUTES_PER_DAY = 1440
+DAY_BYTES = MINUTES_PER_DAY // 8
+# 缓存的 (设备, 日期) 数量上限，每项 180 字节
+HEATMAP_CACHE_SIZE = int(os.environ.get('HEATMAP_CACHE_SIZE', 20000))
+# 当天结束后再过这么久才缓存，避免跨零点那一轮扫描的结果晚写入
+CACHE_SETTLE = timedelta(minutes=5)
+
+# 已经结束的日期不会再变化：(device_id, date) -> bytes
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+def _cache_get(key):
+    with _lock:
+        value = _cache.get(key)
+        if value is not None:
+            _cache.move_to_end(key)
+        return value
+
+def _cache_put(key, value):
+    with _lock:
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > HEATMAP_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def clear_cache(device_id=None):
+    with _lock:
+        if device_id is None:
+            _cache.clear()
+        else:
+            for key in [key for key in _cache if key[0] == device_id]:
+                del _cache[key]
+
+def _set_range(bits, start, end):
+    # 置位 [start, end) 分钟；整字节部分直接写 0xFF
+    while start < end and start & 7:
+        bits[start >> 3] |= 0x80 >> (start & 7)
+        start += 1
+    while start + 8 <= end:
+        bits[start >> 3] = 0xFF
+        start += 8
+    while start < end:
+        bits[start >> 3] |= 0x80 >> (start & 7)
+        start += 1
+
+# 设备最早的分钟汇总时间；之后的分钟都由汇总覆盖（扫描器每轮都写汇总）
+def _rollups_from(session, device_id):
+    return session.query(func.min(PresenceRollup.bucket_start))\
+        .filter(PresenceRollup.device_id == device_id)\
+        .filter(PresenceRollup.resolution == 'minute')\
+        .scalar()
+
+# 读取 [start, end) 内每分钟的在线情况，返回 ({date: bytearray(180)}, 汇总覆盖起点)
+# 汇总覆盖起点之后读分钟汇总，之前（升级前、未补算）读区间或原始记录，同一天可能两部分拼接
+def _load_days(session, device_id, start, end):
+    days = {}
+    def bits_of(timestamp):
+        day = timestamp.date()
+        if day not in days:
+            days[day] = bytearray(DAY_BYTES)
+        return days[day]
+
+    covered_from = _rollups_from(session, device_id)
+    split = end if covered_from is None else min(max(covered_from, start), end)
+
+    if split < end:
+        rows = session.query(PresenceRollup.bucket_start, PresenceRollup.online_samples, PresenceRollup.samples)\
+            .filter(PresenceRollup.device_id == device_id)\
+            .filter(PresenceRollup.resolution == 'minute')\
+            .filter(PresenceRollup.bucket_start >= split)\
+            .filter(PresenceRollup.bucket_start < end)\
+            .all()
+        for bucket, online_samples, samples in rows:
+            if samples and (online_samples or 0) * 2 >= samples:
+                minute = bucket.hour * 60 + bucket.minute
+                bits_of(bucket)[minute >> 3] |= 0x80 >> (minute & 7)
+
+    if start < split:
+        _load_raw(session, device_id, start, split, bits_of)
+    return days, covered_from
+
+def _load_raw(session, device_id, start, end, bits_of):
+    if presence_intervals.stores_intervals():
+        intervals = session.query(PresenceInterval.start_time, PresenceInterval.end_time)\
+            .filter(PresenceInterval.device_id == device_id)\
+            .filter(PresenceInterval.is_online == True)\
+            .filter(PresenceInterval.end_time >= start)\
+            .filter(PresenceInterval.start_time < end)\
+            .all()
+        for interval_start, interval_end in intervals:
+            current = max(interval_start, start)
+            interval_end = min(interval_end, end - timedelta(microseconds=1))
+            # 按天切开区间
+            while current <= interval_end:
+                day_start = current.replace(hour=0, minute=0, second=0, microsecond=0)
+                last = min(interval_end, day_start + timedelta(days=1) - timedelta(microseconds=1))
+                _set_range(bits_of(current), current.hour * 60 + current.minute, last.hour * 60 + last.minute + 1)
+                current = day_start + timedelta(days=1)
+        return
+
+    rows = session.query(DeviceHistory.timestamp)\
+        .filter(DeviceHistory.device_id == device_id)\
+        .filter(DeviceHistory.is_online == True)\
+        .filter(DeviceHistory.timestamp >= start)\
+        .filter(DeviceHistory.timestamp < end)\
+        .yield_per(5000)
+    for (timestamp,) in rows:
+        minute = timestamp.hour * 60 + timestamp.minute
+        bits_of(timestamp)[minute >> 3] |= 0x80 >> (minute & 7)
+
+# 返回最近 days 天(含今天)每天 1440 位的在线位图 [(date, bytes)]，按日期升序
+# 第 m 分钟对应第 m//8 字节的第 m%8 位(高位在前)
+def load_matrix(session, device_id, days, now=None):
+    now = now or datetime.now()
+    today = now.date()
+    dates = [today - timedelta(days=i) for i in range(days - 1, -1, -1)]
+
+    matrix = {}
+    missing = []
+    for day in dates:
+        cached = _cache_get((device_id, day))
+        if cached is not None:
+            matrix[day] = cached
+        else:
+            missing.append(day)
+
+    if missing:
+        # 缺失的日期一次查询
+        start = datetime.combine(missing[0], datetime.min.time())
+        end = datetime.combine(missing[-1], datetime.min.time()) + timedelta(days=1)
+        loaded, covered_from = _load_days(session, device_id, start, end)
+        for day in missing:
+            bits = bytes(loaded.get(day, bytes(DAY_BYTES)))
+            matrix[day] = bits
+            day_start = datetime.combine(day, datetime.min.time())
+            # 只缓存已结束且数据完整的日期：由汇总覆盖，或原始记录中有数据；
+            # 汇总覆盖之前又没有任何记录的日期可能只是尚未补算，不缓存
+            complete = (covered_from is not None and day_start >= covered_from) or day in loaded
+            if complete and day_start + timedelta(days=1) + CACHE_SETTLE <= now:
+                _cache_put((device_id, day), bits)
+
+    return [(day, matrix[day]) for day in dates]
+
+# 位图转为在线区段 [[起始分钟, 分钟数], ...]
+def run_lengths(bits):
+    runs = []
+    value = int.from_bytes(bits, 'big')
+    if not value:
+        return runs
+    minute = 0
+    while minute < MINUTES_PER_DAY:
+        if value >> (MINUTES_PER_DAY - 1 - minute) & 1:
+            start = minute
+            while minute < MINUTES_PER_DAY and value >> (MINUTES_PER_DAY - 1 - minute) & 1:
+                minute += 1
+            runs.append([start, minute - start])
+        else:
+            minute += 1
+    return runs
+
+# 按 encoding 编码一天的数据：bits 为 base64 位图，rle 为在线区段
+def encode_day(bits, encoding='bits'):
+    if encoding == 'rle':
+        return run_lengths(bits)
+    return base64.b64encode(bits).decode('ascii')
@@ -0,0 +1,162 @@
+import logging
+import os
+import sys
+from datetime import datetime
+from types import SimpleNamespace
+from sqlalchemy import func, insert, update
+from models import DeviceHistory, PresenceInterval, get_db_session
+
+logger = logging.getLogger('presence_intervals')
+
+# 历史存储模式：samples 每次检测一行(旧方式)，intervals 只记录在线/离线区间，both 两者都写
+HISTORY_MODE = os.environ.get('HISTORY_MODE', 'samples').strip().lower()
+# 两次检测间隔超过该秒数时不再延长原区间，而是新开一段（期间状态未知）
+INTERVAL_MAX_GAP = int(os.environ.get('INTERVAL_MAX_GAP', 300))
+
+CHUNK_SIZE = 500
+
+def stores_samples():
+    return HISTORY_MODE in ('samples', 'both')
+
+def stores_intervals():
+    return HISTORY_MODE in ('intervals', 'both')
+
+# 加载每个设备最近的一段区间，返回 {device_id: 区间行}
+def load_open_intervals(session, device_ids):
+    device_ids = list(device_ids)
+    latest = {}
+    for i in range(0, len(device_ids), CHUNK_SIZE):
+        chunk = device_ids[i:i + CHUNK_SIZE]
+        latest_ids = session.query(func.max(PresenceInterval.id))\
+            .filter(PresenceInterval.device_id.in_(chunk))\
+            .group_by(PresenceInterval.device_id)
+        rows = session.query(PresenceInterval).filter(PresenceInterval.id.in_(latest_ids.scalar_subquery())).all()
+        for row in rows:
+            latest[row.device_id] = row
+    return latest
+
+def _can_extend(interval, is_online, timestamp):
+    return (
+        interval is not None
+        and interval.is_online == is_online
+        and (timestamp - interval.end_time).total_seconds() <= INTERVAL_MAX_GAP
+    )
+
+def _extended(interval, timestamp, response_time):
+    samples = interval.samples or 1
+    rtt_avg, rtt_min, rtt_max = interval.rtt_avg, interval.rtt_min, interval.rtt_max
+    if response_time is not None:
+        rtt_avg = response_time if rtt_avg is None else (rtt_avg * samples + response_time) / (samples + 1)
+        rtt_min = response_time if rtt_min is None else min(rtt_min, response_time)
+        rtt_max = response_time if rtt_max is None else max(rtt_max, response_time)
+    return {
+        'end_time': timestamp, 'samples': samples + 1,
+        'rtt_avg': rtt_avg, 'rtt_min': rtt_min, 'rtt_max': rtt_max
+    }
+
+def _new_interval(device_id, is_online, timestamp, response_time):
+    return {
+        'device_id': device_id, 'is_online': is_online, 'start_time': timestamp, 'end_time': timestamp,
+        'samples': 1, 'rtt_avg': response_time, 'rtt_min': response_time, 'rtt_max': response_time
+    }
+
+# 记录一轮检测结果 [(device_id, 是否在线, 响应时间ms)]：状态不变则延长区间，变化则新开区间
+# 不提交，由调用方在扫描事务中提交
+def record_observations(session, observations, now=None):
+    now = now or datetime.now()
+    latest = load_open_intervals(session, [device_id for device_id, _, _ in observations])
+
+    inserts = []
+    updates = []
+    for device_id, is_online, response_time in observations:
+        interval = latest.get(device_id)
+        if _can_extend(interval, is_online, now):
+            values = _extended(interval, now, response_time)
+            values['id'] = interval.id
+            updates.append(values)
+        else:
+            inserts.append(_new_interval(device_id, is_online, now, response_time))
+
+    if updates:
+        session.execute(update(PresenceInterval), updates)
+    if inserts:
+        session.execute(insert(PresenceInterval), inserts)
+    return len(inserts), len(updates)
+
+# 把区间还原为逐次检测的时间线（按区间内的检测次数均匀展开），格式与 /api/history 一致
+def load_timeline(session, device_id, cutoff):
+    intervals = session.query(PresenceInterval)\
+        .filter(PresenceInterval.device_id == device_id)\
+        .filter(PresenceInterval.end_time >= cutoff)\
+        .order_by(PresenceInterval.start_time)\
+        .all()
+
+    result = []
+    for interval in intervals:
+        result.extend(expand_interval(interval, cutoff))
+    return result
+
+# 把一个区间按检测次数展开为均匀分布的数据点，跳过 cutoff 之前和 end(不含)之后的点
+def expand_interval(interval, cutoff, end=None):
+    samples = max(interval.samples or 1, 1)
+    step = (interval.end_time - interval.start_time) / (samples - 1) if samples > 1 else None
+    for i in range(samples):
+        timestamp = interval.start_time + step * i if step is not None else interval.start_time
+        if timestamp < cutoff or (end is not None and timestamp >= end):
+            continue
+        yield {
+            "timestamp": timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+            "online": interval.is_online,
+            "response_time": interval.rtt_avg if interval.is_online else None
+        }
+
+# 从 device_history 生成区间数据；已有区间的设备会跳过，可重复执行
+def migrate_from_history(batch_size=5000):
+    session = get_db_session()
+    try:
+        migrated_devices = {row[0] for row in session.query(PresenceInterval.device_id).distinct()}
+        device_ids = [
+            row[0] for row in session.query(DeviceHistory.device_id).distinct()
+            if row[0] is not None and row[0] not in migrated_devices
+        ]
+
+        history_rows = 0
+        interval_rows = 0
+        # 按设备逐个迁移并提交，单个设备的历史量可控，也不会长时间占用写锁
+        for device_id in device_ids:
+            rows = session.query(DeviceHistory.timestamp, DeviceHistory.is_online, DeviceHistory.response_time)\
+                .filter(DeviceHistory.device_id == device_id)\
+                .order_by(DeviceHistory.timestamp)\
+                .yield_per(batch_size)
+
+            intervals = []
+            current = None
+            for timestamp, is_online, response_time in rows:
+                history_rows += 1
+                is_online = bool(is_online)
+                if _can_extend(current, is_online, timestamp):
+                    current.__dict__.update(_extended(current, timestamp, response_time))
+                else:
+                    current = SimpleNamespace(**_new_interval(device_id, is_online, timestamp, response_time))
+                    intervals.append(current)
+
+            for i in range(0, len(intervals), batch_size):
+                session.execute(insert(PresenceInterval), [vars(item) for item in intervals[i:i + batch_size]])
+            session.commit()
+            interval_rows += len(intervals)
+
+        logger.info(f"已将 {history_rows} 条历史记录合并为 {interval_rows} 个区间")
+        return interval_rows
+    except Exception as e:
+        logger.error(f"迁移历史记录失败: {str(e)}")
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        migrate_from_history()
+    else:
+        print("用法: python presence_intervals.py migrate")
@@ -0,0 +1,209 @@
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, update
+from models import DeviceHistory, PresenceRollup, get_db_session
+import presence_heatmap
+
+logger = logging.getLogger('presence_rollups')
+
+RESOLUTIONS = ('minute', 'hour', 'day')
+
+# 各粒度汇总数据的保留天数
+ROLLUP_RETENTION_DAYS = {
+    'minute': int(os.environ.get('ROLLUP_MINUTE_RETENTION_DAYS', 30)),
+    'hour': int(os.environ.get('ROLLUP_HOUR_RETENTION_DAYS', 180)),
+    'day': int(os.environ.get('ROLLUP_DAY_RETENTION_DAYS', 730)),
+}
+
+# /api/history 各时间段默认使用的粒度；raw 表示原始记录
+PERIOD_RESOLUTION = {
+    'daily': 'raw',
+    'weekly': 'minute',
+    'monthly': 'hour',
+}
+
+CHUNK_SIZE = 500
+
+# 时间所在分桶的起点
+def bucket_start(timestamp, resolution):
+    if resolution == 'minute':
+        return timestamp.replace(second=0, microsecond=0)
+    if resolution == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if resolution == 'day':
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"未知的汇总粒度: {resolution}")
+
+def _empty(device_id, resolution, start):
+    return {
+        'device_id': device_id, 'resolution': resolution, 'bucket_start': start,
+        'samples': 0, 'online_samples': 0, 'rtt_count': 0, 'rtt_sum': 0.0, 'rtt_min': None, 'rtt_max': None
+    }
+
+def _accumulate(values, is_online, response_time):
+    values['samples'] += 1
+    if is_online:
+        values['online_samples'] += 1
+    if response_time is not None:
+        values['rtt_count'] += 1
+        values['rtt_sum'] += response_time
+        values['rtt_min'] = response_time if values['rtt_min'] is None else min(values['rtt_min'], response_time)
+        values['rtt_max'] = response_time if values['rtt_max'] is None else max(values['rtt_max'], response_time)
+
+def _row_values(row):
+    return {
+        'id': row.id, 'samples': row.samples or 0, 'online_samples': row.online_samples or 0,
+        'rtt_count': row.rtt_count or 0, 'rtt_sum': row.rtt_sum or 0.0, 'rtt_min': row.rtt_min, 'rtt_max': row.rtt_max
+    }
+
+# 把一轮检测结果 [(device_id, 是否在线, 响应时间ms)] 累加到三个粒度的分桶
+# 同一轮扫描共用一个时间点，所以每个粒度只需查询一次已有分桶；不提交，由调用方提交
+def record_observations(session, observations, now=None):
+    now = now or datetime.now()
+    device_ids = list({device_id for device_id, _, _ in observations})
+
+    for resolution in RESOLUTIONS:
+        start = bucket_start(now, resolution)
+        existing = {}
+        for i in range(0, len(device_ids), CHUNK_SIZE):
+            rows = session.query(PresenceRollup)\
+                .filter(PresenceRollup.resolution == resolution)\
+                .filter(PresenceRollup.bucket_start == start)\
+                .filter(PresenceRollup.device_id.in_(device_ids[i:i + CHUNK_SIZE]))\
+                .all()
+            for row in rows:
+                existing[row.device_id] = _row_values(row)
+
+        inserts = {}
+        for device_id, is_online, response_time in observations:
+            values = existing.get(device_id)
+            if values is None:
+                values = inserts.setdefault(device_id, _empty(device_id, resolution, start))
+            _accumulate(values, is_online, response_time)
+
+        if existing:
+            session.execute(update(PresenceRollup), list(existing.values()))
+        if inserts:
+            session.execute(insert(PresenceRollup), list(inserts.values()))
+
+# 一个分桶转为 /api/history 的数据点，附带在线率和响应时间统计
+def rollup_point(row):
+    ratio = (row.online_samples or 0) / row.samples if row.samples else 0
+    return {
+        "timestamp": row.bucket_start.strftime("%Y-%m-%d %H:%M:%S"),
+        "online": ratio >= 0.5,
+        "online_ratio": round(ratio, 3),
+        "samples": row.samples,
+        "response_time": round(row.rtt_sum / row.rtt_count, 3) if row.rtt_count else None,
+        "rtt_min": row.rtt_min,
+        "rtt_max": row.rtt_max
+    }
+
+# 读取一个设备在 cutoff 之后的汇总数据，格式与 /api/history 兼容
+def load_rollups(session, device_id, resolution, cutoff):
+    rows = session.query(PresenceRollup)\
+        .filter(PresenceRollup.device_id == device_id)\
+        .filter(PresenceRollup.resolution == resolution)\
+        .filter(PresenceRollup.bucket_start >= bucket_start(cutoff, resolution))\
+        .order_by(PresenceRollup.bucket_start)\
+        .all()
+    return [rollup_point(row) for row in rows]
+
+# 按时间跨度选择粒度，与 PERIOD_RESOLUTION 一致
+def resolution_for_span(span):
+    if span <= timedelta(days=1):
+        return 'raw'
+    if span <= timedelta(weeks=1):
+        return 'minute'
+    return 'hour'
+
+def _merge(values, row):
+    values['samples'] += row.samples or 0
+    values['online_samples'] += row.online_samples or 0
+    values['rtt_count'] += row.rtt_count or 0
+    values['rtt_sum'] += row.rtt_sum or 0.0
+    for key, pick in (('rtt_min', min), ('rtt_max', max)):
+        current = getattr(row, key)
+        if current is not None:
+            values[key] = current if values[key] is None else pick(values[key], current)
+
+# 用 device_history 补算汇总数据，可重复执行
+# 扫描器在升级后的第一轮就开始写汇总，所以只补算每个设备最早的分钟汇总之前的记录；
+# 补算的小时/天分桶若已存在（与升级后的扫描落在同一小时/天），在原有数据上累加
+def backfill_from_history(batch_size=5000):
+    session = get_db_session()
+    try:
+        device_ids = [row[0] for row in session.query(DeviceHistory.device_id).distinct() if row[0] is not None]
+        # 每个设备最早的分钟汇总；分钟汇总已被清理但还有其他汇总的设备说明早已汇总过，跳过
+        first_minute = dict(
+            session.query(PresenceRollup.device_id, func.min(PresenceRollup.bucket_start))
+            .filter(PresenceRollup.resolution == 'minute')
+            .group_by(PresenceRollup.device_id)
+            .all()
+        )
+        rolled_up = {row[0] for row in session.query(PresenceRollup.device_id).distinct()}
+
+        total = 0
+        devices = 0
+        for device_id in device_ids:
+            cutoff = first_minute.get(device_id)
+            if cutoff is None and device_id in rolled_up:
+                continue
+
+            buckets = {}
+            rows = session.query(DeviceHistory.timestamp, DeviceHistory.is_online, DeviceHistory.response_time)\
+                .filter(DeviceHistory.device_id == device_id)
+            if cutoff is not None:
+                rows = rows.filter(DeviceHistory.timestamp < cutoff)
+            for timestamp, is_online, response_time in rows.yield_per(batch_size):
+                for resolution in RESOLUTIONS:
+                    start = bucket_start(timestamp, resolution)
+                    values = buckets.get((resolution, start))
+                    if values is None:
+                        values = buckets[(resolution, start)] = _empty(device_id, resolution, start)
+                    _accumulate(values, bool(is_online), response_time)
+            if not buckets:
+                continue
+
+            updates = []
+            if cutoff is not None:
+                # 只有包含 cutoff 的小时/天分桶可能已存在
+                existing = session.query(PresenceRollup)\
+                    .filter(PresenceRollup.device_id == device_id)\
+                    .filter(PresenceRollup.bucket_start <= cutoff)\
+                    .all()
+                for row in existing:
+                    values = buckets.pop((row.resolution, row.bucket_start), None)
+                    if values is not None:
+                        _merge(values, row)
+                        values['id'] = row.id
+                        del values['device_id'], values['resolution'], values['bucket_start']
+                        updates.append(values)
+            if updates:
+                session.execute(update(PresenceRollup), updates)
+            values = list(buckets.values())
+            for i in range(0, len(values), batch_size):
+                session.execute(insert(PresenceRollup), values[i:i + batch_size])
+            session.commit()
+            total += len(values) + len(updates)
+            devices += 1
+
+        # 本进程内缓存的热力图可能是补算前生成的
+        presence_heatmap.clear_cache()
+        logger.info(f"已为 {devices} 个设备补算 {total} 条汇总数据")
+        return total
+    except Exception as e:
+        logger.error(f"补算汇总数据失败: {str(e)}")
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "backfill":
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        backfill_from_history()
+    else:
+        print("用法: python presence_rollups.py backfill")
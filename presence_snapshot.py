@@ -0,0 +1,73 @@
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from models import get_db_session
+import status_service
+
+logger = logging.getLogger('presence_snapshot')
+
+# 一次扫描结束后的设备/状态/网段快照；创建后不再修改，替换时整体换掉引用
+# payload 为 /api/status 的数据(只读)，body 为预先序列化好的 JSON
+Snapshot = namedtuple('Snapshot', ['version', 'etag', 'payload', 'body', 'created_at'])
+
+_current = None
+_version = 0
+_lock = threading.Lock()
+_listeners = []
+
+# 注册快照发布后的回调 callback(snapshot)，在发布快照的线程中调用
+def subscribe(callback):
+    _listeners.append(callback)
+
+# 从数据库生成新快照并发布，返回新快照
+# 读库和替换在同一把锁内完成：并发发布时，较晚读到的数据一定得到较大的版本号，旧数据不会覆盖新快照
+def publish(session=None):
+    global _current, _version
+    with _lock:
+        own_session = session is None
+        if own_session:
+            session = get_db_session()
+        try:
+            payload = status_service.build_status(session)
+        finally:
+            if own_session:
+                session.close()
+
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        _version += 1
+        snapshot = Snapshot(
+            version=_version,
+            etag=f"status-{_version}-{int(time.time())}",
+            payload=payload,
+            body=body,
+            created_at=time.time()
+        )
+        _current = snapshot
+    logger.debug(f"已发布状态快照 v{snapshot.version} ({len(body)} 字节)")
+
+    # 已有更新的快照发布时，由那次发布通知回调，不再用旧快照覆盖
+    if _current is not snapshot:
+        return snapshot
+    for callback in list(_listeners):
+        try:
+            callback(snapshot)
+        except Exception as e:
+            logger.error(f"快照回调 {getattr(callback, '__name__', callback)} 执行失败: {str(e)}")
+    return snapshot
+
+# 当前快照；冷启动时还没有扫描结果，从数据库加载一次
+def get():
+    snapshot = _current
+    if snapshot is None:
+        snapshot = publish()
+    return snapshot
+
+# 发布快照但不让异常影响调用方（扫描线程、设备编辑接口）
+def publish_quietly():
+    try:
+        return publish()
+    except Exception as e:
+        logger.error(f"发布状态快照失败: {str(e)}")
+        return None
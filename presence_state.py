@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+# 在线状态机：online → suspect → offline
+# 在线设备漏掉一次探测先进入 suspect（仍按在线处理，不写库也不推送），连续 PRESENCE_MISS_THRESHOLD 轮扫描
+# 未响应且距第一次未响应超过 PRESENCE_GRACE_PERIOD 秒才确认离线；每轮扫描最多记一次未响应，
+# 同一轮内的重探测只能让设备恢复在线，不会累计次数，所以 suspect 状态会跨越多轮扫描。
+# suspect 期间任何一次响应都直接回到 online，不产生上线/离线记录。PRESENCE_MISS_THRESHOLD=1 即旧行为
+PRESENCE_MISS_THRESHOLD = int(os.environ.get('PRESENCE_MISS_THRESHOLD', 3))
+PRESENCE_GRACE_PERIOD = float(os.environ.get('PRESENCE_GRACE_PERIOD', 0))
+# suspect 主机不等下一轮扫描，间隔 PRESENCE_REPROBE_DELAY 秒立即重新探测，最多 PRESENCE_REPROBES 次，尽早恢复在线
+PRESENCE_REPROBES = int(os.environ.get('PRESENCE_REPROBES', 2))
+PRESENCE_REPROBE_DELAY = float(os.environ.get('PRESENCE_REPROBE_DELAY', 2.0))
+
+ONLINE = 'online'
+SUSPECT = 'suspect'
+OFFLINE = 'offline'
+
+# 记录每台在线/可疑主机的状态；离线主机不保存，下次用调用方提供的 was_online 初始化
+class PresenceTracker:
+    def __init__(self, miss_threshold=None, grace_period=None):
+        self.miss_threshold = max(1, PRESENCE_MISS_THRESHOLD if miss_threshold is None else miss_threshold)
+        self.grace_period = PRESENCE_GRACE_PERIOD if grace_period is None else grace_period
+        self._hosts = {}  # ip -> [状态, 连续未响应次数, 第一次未响应时间]
+        self._lock = threading.Lock()
+        self.went_online = 0
+        self.went_offline = 0
+        self.recovered = 0  # suspect 后又响应、被抑制的离线次数
+
+    # 更新一批主机，seen 为 {ip: 本次是否响应}，was_online(ip) 返回尚未跟踪的主机之前是否在线
+    # count_miss 为 False 时（同一轮内的重探测）未响应不累计次数，只有响应会改变状态
+    # 返回 {ip: 状态}
+    def update(self, seen, was_online, now=None, count_miss=True):
+        now = now or time.time()
+        states = {}
+        with self._lock:
+            for ip, responded in seen.items():
+                states[ip] = self._observe(ip, responded, was_online, now, count_miss)
+        return states
+
+    def _observe(self, ip, responded, was_online, now, count_miss):
+        host = self._hosts.get(ip)
+        if host is None:
+            if not was_online(ip):
+                if responded:
+                    self.went_online += 1
+                    self._hosts[ip] = [ONLINE, 0, None]
+                    return ONLINE
+                return OFFLINE
+            host = self._hosts[ip] = [ONLINE, 0, None]
+
+        if responded:
+            if host[0] == SUSPECT:
+                self.recovered += 1
+            host[:] = [ONLINE, 0, None]
+            return ONLINE
+
+        if not count_miss:
+            return host[0]
+        host[1] += 1
+        host[2] = host[2] or now
+        if host[1] >= self.miss_threshold and now - host[2] >= self.grace_period:
+            del self._hosts[ip]
+            self.went_offline += 1
+            return OFFLINE
+        host[0] = SUSPECT
+        return SUSPECT
+
+    def stats(self):
+        with self._lock:
+            suspects = sum(1 for host in self._hosts.values() if host[0] == SUSPECT)
+            tracked = len(self._hosts)
+        return {
+            "tracked": tracked,
+            "suspect": suspects,
+            "went_online": self.went_online,
+            "went_offline": self.went_offline,
+            "recovered": self.recovered
+        }
+
+# 用一轮探测结果 {ip: 响应时间ms 或 None} 更新状态机，suspect 主机立即用 probe(ips) 重新探测
+# online 为其他方式确认在线的IP（如邻居表）；重探测得到的响应时间直接补进 results
+# 返回 {ip: 状态}，扫描器只为 online/offline 的主机写入结果，suspect 主机保持原状
+# 每次调用算一轮扫描：重探测仍未响应的主机保持 suspect，到下一轮再累计未响应次数
+def settle(tracker, results, was_online, probe, online=(), reprobes=None, delay=None):
+    reprobes = PRESENCE_REPROBES if reprobes is None else reprobes
+    delay = PRESENCE_REPROBE_DELAY if delay is None else delay
+    states = tracker.update({ip: rtt is not None or ip in online for ip, rtt in results.items()}, was_online)
+    for _ in range(reprobes):
+        suspects = [ip for ip, state in states.items() if state == SUSPECT]
+        if not suspects:
+            break
+        time.sleep(delay)
+        found = probe(suspects)
+        for ip in suspects:
+            if found.get(ip) is not None:
+                results[ip] = found[ip]
+        states.update(tracker.update({ip: found.get(ip) is not None for ip in suspects}, was_online, count_miss=False))
+    return states
+
+_tracker = PresenceTracker()
+
+def get_tracker():
+    return _tracker
@@ -0,0 +1,104 @@
+import logging
+import os
+import random
+import threading
+import time
+
+logger = logging.getLogger('probe_schedule')
+
+# adaptive 按主机存活情况决定每轮探测哪些地址；all 每轮探测整个网段（旧行为）
+PROBE_SCHEDULE = os.environ.get('PROBE_SCHEDULE', 'adaptive').strip().lower()
+# 从未在线过的地址多久探测一次(秒)，各地址加随机抖动分散到不同轮次
+PROBE_DISCOVERY_INTERVAL = float(os.environ.get('PROBE_DISCOVERY_INTERVAL', 600))
+# 已知设备最后在线超过 PROBE_BACKOFF_IDLE 秒后才开始退避（默认 1 天），此前每轮都探测；
+# 退避间隔从 PROBE_BACKOFF_BASE 秒起每次翻倍，最长 PROBE_BACKOFF_MAX 秒，即长期离线的设备回来后最多这么久才显示在线
+PROBE_BACKOFF_IDLE = float(os.environ.get('PROBE_BACKOFF_IDLE', 86400))
+PROBE_BACKOFF_BASE = float(os.environ.get('PROBE_BACKOFF_BASE', 60))
+PROBE_BACKOFF_MAX = float(os.environ.get('PROBE_BACKOFF_MAX', 300))
+
+# 记录每个地址连续未响应次数和下次探测时间，决定一轮扫描需要探测的地址：
+# - 已知设备（有 DeviceStatus）每轮都探测
+# - 只有最后在线超过 PROBE_BACKOFF_IDLE 秒的已知设备按指数退避
+# - 从未在线过的地址按 PROBE_DISCOVERY_INTERVAL 的节奏探测
+# 进程启动后第一次见到的地址总会探测一次；状态只保存在内存中
+class ProbeSchedule:
+    def __init__(self, mode=PROBE_SCHEDULE, discovery_interval=PROBE_DISCOVERY_INTERVAL,
+                 backoff_idle=PROBE_BACKOFF_IDLE, backoff_base=PROBE_BACKOFF_BASE, backoff_max=PROBE_BACKOFF_MAX):
+        self.mode = mode
+        self.discovery_interval = discovery_interval
+        self.backoff_idle = backoff_idle
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._hosts = {}  # ip -> [连续未响应次数（已知设备只计长期离线后的次数）, 下次探测时间]
+        self._lock = threading.Lock()
+        self.planned = 0
+        self.skipped = 0
+
+    def adaptive(self):
+        return self.mode == 'adaptive'
+
+    # 从 ips 中选出本轮需要探测的地址，顺序不变；known 为 scan_writer.load_known_devices 的结果
+    def plan(self, ips, known, now=None):
+        ips = list(ips)
+        if not self.adaptive():
+            return ips
+        now = now or time.time()
+        due = []
+        with self._lock:
+            for ip in ips:
+                row = known.get(ip)
+                state = self._hosts.get(ip)
+                if (row is not None and row.status_id is not None and not self._idle(row, now)) or state is None or now >= state[1]:
+                    due.append(ip)
+            self.planned += len(due)
+            self.skipped += len(ips) - len(due)
+        return due
+
+    # 记录本轮探测结果 {ip: 响应时间ms 或 None}，online 为其他方式确认在线的地址（如邻居表）
+    def record(self, results, known, online=(), now=None):
+        if not self.adaptive():
+            return
+        now = now or time.time()
+        with self._lock:
+            for ip, response_time in results.items():
+                if response_time is not None or ip in online:
+                    self._hosts.pop(ip, None)
+                    continue
+                state = self._hosts.setdefault(ip, [0, now])
+                row = known.get(ip)
+                if row is not None and row.status_id is not None:
+                    if self._idle(row, now):
+                        state[0] += 1
+                        state[1] = now + self._backoff(state[0])
+                    else:
+                        state[:] = [0, now]
+                else:
+                    state[0] += 1
+                    state[1] = now + self.discovery_interval * random.uniform(0.5, 1.5)
+
+    # 已知设备是否已长期离线：在线的不算，离线且最后在线时间未知或早于 backoff_idle 秒前的算
+    def _idle(self, row, now):
+        if row.is_online:
+            return False
+        last_seen = getattr(row, 'last_seen', None)
+        return last_seen is None or now - last_seen.timestamp() >= self.backoff_idle
+
+    def _backoff(self, misses):
+        return min(self.backoff_base * 2 ** (misses - 1), self.backoff_max)
+
+    def stats(self):
+        with self._lock:
+            tracked = len(self._hosts)
+            backing_off = sum(1 for misses, _ in self._hosts.values() if misses > 0)
+        return {
+            "mode": self.mode,
+            "tracked": tracked,
+            "backing_off": backing_off,
+            "planned": self.planned,
+            "skipped": self.skipped
+        }
+
+_schedule = ProbeSchedule()
+
+def get_schedule():
+    return _schedule
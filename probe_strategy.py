@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from ping3 import ping
+import icmp_prober
+
+logger = logging.getLogger('probe_strategy')
+
+# 探测后端
+BACKEND_ICMP = 'icmp'              # 进程内共享套接字 (icmp_prober)
+BACKEND_PING3 = 'ping3'            # 每个包一个套接字
+BACKEND_SUBPROCESS = 'subprocess'  # 系统 ping 命令，每次探测 fork 一个进程
+BACKENDS = (BACKEND_ICMP, BACKEND_PING3, BACKEND_SUBPROCESS)
+
+# auto 表示启动时检测：能打开 ICMP 套接字就用进程内探测，否则才用系统 ping
+PROBE_BACKEND = os.environ.get('PROBE_BACKEND', 'auto').strip().lower()
+
+_backend = None
+_backend_lock = threading.Lock()
+
+# 各后端的探测次数(发出的包数 / fork 的进程数)，以及探测出错次数
+_counters = {name: 0 for name in BACKENDS}
+_counters['errors'] = 0
+_counters_lock = threading.Lock()
+
+def _count(name, n=1):
+    with _counters_lock:
+        _counters[name] += n
+
+# 返回探测计数的副本
+def get_counters():
+    with _counters_lock:
+        return dict(_counters)
+
+# 合并其他进程（scan_pool 的探测子进程）的探测计数
+def add_counters(counts):
+    with _counters_lock:
+        for name, n in counts.items():
+            if name in _counters:
+                _counters[name] += n
+
+def reset_counters():
+    with _counters_lock:
+        for name in _counters:
+            _counters[name] = 0
+
+# 检测可用的探测后端，结果在进程内缓存
+def detect_backend(force=False):
+    global _backend
+    with _backend_lock:
+        if _backend is not None and not force:
+            return _backend
+
+        if PROBE_BACKEND in BACKENDS:
+            _backend = PROBE_BACKEND
+            logger.info(f"使用配置的探测后端: {_backend}")
+            return _backend
+
+        try:
+            icmp_prober.open_icmp_socket().close()
+            _backend = BACKEND_ICMP
+            logger.info("探测后端: 进程内 ICMP 套接字")
+        except OSError as e:
+            _backend = BACKEND_SUBPROCESS
+            logger.warning(f"无法打开 ICMP 套接字({str(e)})，探测后端回退为系统 ping 命令")
+        return _backend
+
+# 手动指定后端（基准测试或运行中降级使用）
+def set_backend(name):
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"未知的探测后端: {name}")
+    with _backend_lock:
+        _backend = name
+
+def _downgrade(error):
+    # 运行中失去 ICMP 权限（如容器能力被收回）时只降级一次，之后不再反复尝试
+    global _backend
+    with _backend_lock:
+        if _backend == BACKEND_ICMP:
+            _backend = BACKEND_SUBPROCESS
+            logger.warning(f"ICMP 套接字不可用({str(error)})，探测后端降级为系统 ping 命令")
+
+def _icmp_sweep(ips, timeout, retries, plan=None):
+    prober = icmp_prober.IcmpProber()
+    try:
+        return asyncio.run(prober.sweep(ips, timeout=timeout, retries=retries, plan=plan))
+    finally:
+        _count(BACKEND_ICMP, prober.packets_sent)
+
+def _ping3_is_online(ip, timeout, retries):
+    for _ in range(retries):
+        _count(BACKEND_PING3)
+        try:
+            result = ping(ip, timeout=timeout)
+            if result is not None and result is not False:
+                return True, result * 1000  # 转换为毫秒
+        except Exception:
+            _count('errors')
+    return False, None
+
+def _subprocess_is_online(ip, timeout, retries):
+    if os.name == 'nt':  # Windows
+        ping_params = ["ping", "-n", "1", "-w", str(int(timeout * 1000)), ip]
+    else:  # Linux/Mac
+        ping_params = ["ping", "-c", "1", "-W", str(timeout), ip]
+
+    for _ in range(retries):
+        _count(BACKEND_SUBPROCESS)
+        try:
+            start_time = time.time()
+            res = subprocess.run(
+                ping_params,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            if res.returncode == 0:
+                return True, (time.time() - start_time) * 1000  # 转换为毫秒
+        except Exception:
+            _count('errors')
+    return False, None
+
+# 判断单个 IP 是否在线，返回 (是否在线, 响应时间ms)
+def is_online(ip, timeout=1, retries=2):
+    backend = detect_backend()
+    if backend == BACKEND_ICMP:
+        try:
+            response_time = _icmp_sweep([ip], timeout, retries).get(ip)
+            return response_time is not None, response_time
+        except OSError as e:
+            _downgrade(e)
+            backend = detect_backend()
+    if backend == BACKEND_PING3:
+        return _ping3_is_online(ip, timeout, retries)
+    return _subprocess_is_online(ip, timeout, retries)
+
+# 探测一组IP，返回 {ip: 响应时间ms 或 None}
+# plan 为 {ip: (超时秒数, 重试次数)}（见 rtt_estimator），未列出的主机使用 timeout/retries
+# ICMP 后端整组共用一个套接字；其他后端用线程池限制同时在途的探测数
+def sweep(ips, timeout=1, retries=2, workers=64, plan=None):
+    ips = list(ips)
+    if not ips:
+        return {}
+
+    if detect_backend() == BACKEND_ICMP:
+        try:
+            return _icmp_sweep(ips, timeout, retries, plan)
+        except OSError as e:
+            _downgrade(e)
+
+    plan = plan or {}
+    found = {}
+    max_workers = max(1, min(workers, len(ips)))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="Probe") as executor:
+        futures = {executor.submit(is_online, ip, *plan.get(ip, (timeout, retries))): ip for ip in ips}
+        for future in as_completed(futures):
+            ip = futures[future]
+            try:
+                online, response_time = future.result()
+                found[ip] = response_time if online else None
+            except Exception as e:
+                _count('errors')
+                logger.warning(f"探测IP {ip} 时出错: {str(e)}")
+                found[ip] = None
+
+    return {ip: found.get(ip) for ip in ips}
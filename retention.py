@@ -0,0 +1,174 @@
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import and_, delete, func, select
+from models import DeviceHistory, PresenceInterval, PresenceRollup, get_db_session
+import db_writer
+import presence_rollups
+import scan_pool
+
+logger = logging.getLogger('retention')
+
+HISTORY_RETENTION_DAYS = int(os.environ.get('HISTORY_RETENTION_DAYS', 30))
+# 清理间隔(秒)，与扫描调度无关
+RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 3600))
+# 每批按主键范围删除的行数，批次越小单次占用写锁的时间越短
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 5000))
+# 两批之间的暂停(秒)，让扫描线程和接口有机会拿到写锁
+RETENTION_PAUSE = float(os.environ.get('RETENTION_PAUSE', 0.2))
+# 删除前把记录写入该目录下的 gzip NDJSON 归档文件，留空不归档
+RETENTION_ARCHIVE_DIR = os.environ.get('RETENTION_ARCHIVE_DIR', '')
+
+# 需要清理的表：(名称, 表, 时间列, 额外条件, 保留天数)
+def retention_targets():
+    targets = [
+        ('device_history', DeviceHistory.__table__, DeviceHistory.timestamp, None, HISTORY_RETENTION_DAYS),
+        # 区间只在整段结束于保留期之前时删除
+        ('presence_intervals', PresenceInterval.__table__, PresenceInterval.end_time, None, HISTORY_RETENTION_DAYS),
+    ]
+    for resolution, days in presence_rollups.ROLLUP_RETENTION_DAYS.items():
+        targets.append((
+            f'presence_rollups.{resolution}', PresenceRollup.__table__, PresenceRollup.bucket_start,
+            PresenceRollup.resolution == resolution, days
+        ))
+    return targets
+
+def _archive_path(name, now, archive_dir):
+    os.makedirs(archive_dir, exist_ok=True)
+    return os.path.join(archive_dir, f"{name}-{now.strftime('%Y%m%d-%H%M%S')}.ndjson.gz")
+
+# 按主键范围分批删除 time_column < cutoff 的行，每批单独提交，返回统计信息
+def prune_table(name, table, time_column, condition, cutoff, batch_size=RETENTION_BATCH_SIZE,
+                pause=RETENTION_PAUSE, archive_dir=RETENTION_ARCHIVE_DIR, now=None):
+    now = now or datetime.now()
+    old = time_column < cutoff
+    if condition is not None:
+        old = and_(old, condition)
+
+    stats = {'deleted': 0, 'batches': 0, 'seconds': 0.0, 'lock_seconds': 0.0, 'max_lock_ms': 0.0, 'archive': None}
+    started = time.time()
+    session = get_db_session()
+    archive = None
+    try:
+        # 过期行的主键上界只算一次；之后新写入的行主键更大，不会被扫到
+        lower, upper = session.execute(select(func.min(table.c.id), func.max(table.c.id)).where(old)).one()
+        session.commit()
+        if upper is None:
+            return stats
+
+        if archive_dir:
+            stats['archive'] = _archive_path(name, now, archive_dir)
+            archive = gzip.open(stats['archive'], 'wt', encoding='utf-8')
+
+        # 每批作为一个写操作交给单写线程，批与批之间扫描和接口的写入可以插队
+        # 返回 (归档时为删除的行，否则为 None, 删除行数, 在写事务中执行的秒数)，提交由写线程统一完成
+        # 写操作可能因合并提交失败被重新执行，所以这里只查询要删除的行，提交成功后再由本线程写归档
+        def delete_range(session, start):
+            lock_started = time.time()
+            in_range = and_(table.c.id >= start, table.c.id < start + batch_size, old)
+            rows = None
+            if archive is not None:
+                rows = [dict(row) for row in session.execute(select(table).where(in_range)).mappings()]
+            deleted = session.execute(delete(table).where(in_range)).rowcount
+            return rows, deleted, time.time() - lock_started
+
+        start = lower
+        while start <= upper:
+            rows, deleted, lock_time = db_writer.run(lambda session, start=start: delete_range(session, start))
+            start += batch_size
+            for row in rows or ():
+                archive.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+            if not deleted:
+                continue
+            stats['deleted'] += deleted
+            stats['batches'] += 1
+            stats['lock_seconds'] += lock_time
+            stats['max_lock_ms'] = max(stats['max_lock_ms'], lock_time * 1000)
+            if pause and start <= upper:
+                time.sleep(pause)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+        if archive is not None:
+            archive.close()
+        stats['seconds'] = time.time() - started
+        if archive is not None and not stats['deleted']:
+            os.remove(stats['archive'])
+            stats['archive'] = None
+    return stats
+
+# 清理所有表一次，返回 {表名: 统计信息}
+def run_once(now=None, **options):
+    now = now or datetime.now()
+    report = {}
+    for name, table, time_column, condition, days in retention_targets():
+        try:
+            stats = prune_table(name, table, time_column, condition, now - timedelta(days=days), now=now, **options)
+        except Exception as e:
+            logger.error(f"清理 {name} 失败: {str(e)}")
+            report[name] = {'error': str(e)}
+            continue
+        stats['rows_per_sec'] = round(stats['deleted'] / stats['seconds'], 1) if stats['seconds'] > 0 else 0
+        for key in ('seconds', 'lock_seconds', 'max_lock_ms'):
+            stats[key] = round(stats[key], 3)
+        report[name] = stats
+        if stats['deleted']:
+            logger.info(
+                f"已清理 {name} {stats['deleted']} 行 (超过 {days} 天)，{stats['batches']} 批，"
+                f"{stats['rows_per_sec']} 行/秒，写锁共 {stats['lock_seconds']:.2f} 秒，单批最长 {stats['max_lock_ms']:.1f} ms"
+                + (f"，已归档到 {stats['archive']}" if stats['archive'] else "")
+            )
+    return report
+
+# 后台清理线程，按 RETENTION_INTERVAL 独立运行
+class RetentionWorker:
+    def __init__(self, interval=RETENTION_INTERVAL):
+        self.interval = interval
+        self.last_run = None
+        self.last_report = None
+        self._stopped = threading.Event()
+
+    def loop(self):
+        while not self._stopped.is_set():
+            try:
+                self.last_report = run_once()
+                self.last_run = datetime.now()
+            except Exception as e:
+                logger.error(f"清理历史数据出错: {str(e)}")
+            self._stopped.wait(self.interval)
+
+    def start(self):
+        logger.info(f"启动历史数据清理线程，每 {self.interval} 秒一次，每批 {RETENTION_BATCH_SIZE} 行")
+        threading.Thread(target=self.loop, daemon=True, name="RetentionWorker").start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "last_run": self.last_run.strftime("%Y-%m-%d %H:%M:%S") if self.last_run else None,
+            "last_report": self.last_report
+        }
+
+_worker = None
+_worker_lock = threading.Lock()
+
+def start(interval=RETENTION_INTERVAL):
+    global _worker
+    if scan_pool.in_worker():
+        return None
+    with _worker_lock:
+        if _worker is None:
+            _worker = RetentionWorker(interval).start()
+    return _worker
+
+def get_worker():
+    return _worker
@@ -0,0 +1,99 @@
+import os
+import threading
+
+# 按设备的响应时间估算探测超时（与 TCP RTO 的算法相同，RFC 6298）：
+#   SRTT ← 7/8·SRTT + 1/8·RTT，RTTVAR ← 3/4·RTTVAR + 1/4·|SRTT − RTT|，超时 = SRTT + 4·RTTVAR
+# 超时限制在 [PROBE_TIMEOUT_MIN, PROBE_TIMEOUT_MAX] 之间；没有响应时间的主机直接用上限
+# on 启用；off 所有主机使用固定的超时和重试次数
+PROBE_ADAPTIVE_TIMEOUT = os.environ.get('PROBE_ADAPTIVE_TIMEOUT', 'on').strip().lower() not in ('off', 'false', '0', 'no')
+PROBE_TIMEOUT_MIN = float(os.environ.get('PROBE_TIMEOUT_MIN', 0.1))
+PROBE_TIMEOUT_MAX = float(os.environ.get('PROBE_TIMEOUT_MAX', 1.5))
+# 单个主机所有重试加起来最多等待的秒数，重试次数 = 该预算 / 超时，限制在 [MIN, MAX] 之间
+# 默认值下没有响应时间记录的主机为 1.5 秒 × 2 次，与固定参数相同
+PROBE_RETRY_BUDGET = float(os.environ.get('PROBE_RETRY_BUDGET', 3.0))
+PROBE_RETRIES_MIN = int(os.environ.get('PROBE_RETRIES_MIN', 1))
+PROBE_RETRIES_MAX = int(os.environ.get('PROBE_RETRIES_MAX', 4))
+
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+# 连续超时时超时时间翻倍的上限倍数，收到响应后恢复
+MAX_BACKOFF = 64
+
+class RttEstimator:
+    def __init__(self, timeout_min=PROBE_TIMEOUT_MIN, timeout_max=PROBE_TIMEOUT_MAX, retry_budget=PROBE_RETRY_BUDGET,
+                 retries_min=PROBE_RETRIES_MIN, retries_max=PROBE_RETRIES_MAX, enabled=PROBE_ADAPTIVE_TIMEOUT):
+        self.timeout_min = timeout_min
+        self.timeout_max = timeout_max
+        self.retry_budget = retry_budget
+        self.retries_min = retries_min
+        self.retries_max = retries_max
+        self.enabled = enabled
+        self._hosts = {}  # ip -> [SRTT ms, RTTVAR ms, 超时倍数]
+        self._lock = threading.Lock()
+
+    # 用一次响应时间(ms)更新估计值
+    def sample(self, ip, rtt):
+        with self._lock:
+            self._sample(ip, rtt)
+
+    def _sample(self, ip, rtt):
+        state = self._hosts.get(ip)
+        if state is None:
+            self._hosts[ip] = [rtt, rtt / 2, 1]
+            return
+        state[1] = (1 - BETA) * state[1] + BETA * abs(state[0] - rtt)
+        state[0] = (1 - ALPHA) * state[0] + ALPHA * rtt
+        state[2] = 1
+
+    # 没有估计值的主机用数据库中最近一次的响应时间作为第一个样本；known 为 scan_writer.load_known_devices 的结果
+    def seed(self, known):
+        with self._lock:
+            for ip, row in known.items():
+                if ip not in self._hosts and getattr(row, 'response_time', None) is not None:
+                    self._sample(ip, row.response_time)
+
+    # 记录一轮探测结果 {ip: 响应时间ms 或 None}；超时的主机下一轮超时翻倍，避免变慢的主机一直被判为离线
+    def observe(self, results):
+        with self._lock:
+            for ip, rtt in results.items():
+                if rtt is not None:
+                    self._sample(ip, rtt)
+                elif ip in self._hosts:
+                    state = self._hosts[ip]
+                    state[2] = min(state[2] * 2, MAX_BACKOFF)
+
+    def _timeout(self, state):
+        if state is None:
+            return self.timeout_max
+        srtt, rttvar, backoff = state
+        return min(max((srtt + K * rttvar) / 1000 * backoff, self.timeout_min), self.timeout_max)
+
+    # 单个主机的 (超时秒数, 重试次数)
+    def params(self, ip):
+        with self._lock:
+            timeout = self._timeout(self._hosts.get(ip))
+        retries = int(self.retry_budget // timeout)
+        return timeout, min(max(retries, self.retries_min), self.retries_max)
+
+    # 一组主机的 {ip: (超时, 重试次数)}；未启用时返回 None，调用方使用固定参数
+    def plan(self, ips):
+        if not self.enabled:
+            return None
+        return {ip: self.params(ip) for ip in ips}
+
+    def stats(self):
+        with self._lock:
+            states = list(self._hosts.values())
+            timeouts = sorted(self._timeout(state) for state in states)
+        return {
+            "enabled": self.enabled,
+            "tracked": len(states),
+            "median_timeout_ms": round(timeouts[len(timeouts) // 2] * 1000, 1) if timeouts else None,
+            "backing_off": sum(1 for state in states if state[2] > 1)
+        }
+
+_estimator = RttEstimator()
+
+def get_estimator():
+    return _estimator
@@ -0,0 +1,100 @@
+import ipaddress
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import models
+import probe_strategy
+
+logger = logging.getLogger('scan_pool')
+
+# 多进程探测：大于 0 时把每次扫描的地址按 SCAN_SHARD_SIZE 分片，交给这么多个子进程并行探测，
+# 父进程只负责汇总结果和写库（经 db_writer）；0 在扫描线程内探测（默认）
+SCAN_PROCESSES = int(os.environ.get('SCAN_PROCESSES', 0))
+SCAN_SHARD_SIZE = int(os.environ.get('SCAN_SHARD_SIZE', 256))
+# 子进程启动方式；Web 进程里已有多个线程，默认不用 fork
+SCAN_PROCESS_START = os.environ.get('SCAN_PROCESS_START', 'forkserver' if os.name == 'posix' else 'spawn')
+
+NO_REPLY = -1.0
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def enabled():
+    return SCAN_PROCESSES > 0
+
+# 是否在 multiprocessing 启动的子进程中（探测子进程、forkserver 服务进程）
+# 子进程只负责探测，任何后台线程（调度、清理、旧版 JSON 导出）都不应启动
+def in_worker():
+    return multiprocessing.current_process().name != 'MainProcess'
+
+# 子进程不访问数据库；fork 出来的子进程丢掉从父进程继承的连接池，避免和父进程共用连接
+def _init_worker():
+    models.dispose_engine()
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=SCAN_PROCESSES,
+                mp_context=multiprocessing.get_context(SCAN_PROCESS_START),
+                initializer=_init_worker
+            )
+            logger.info(f"启动 {SCAN_PROCESSES} 个探测子进程，每片 {SCAN_SHARD_SIZE} 个地址")
+        return _pool
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+
+# 子进程：探测一片地址。参数和返回值都是紧凑数组，减少进程间序列化的开销
+#   addresses  array('I') IPv4 地址
+#   timeouts   array('d') / retries array('B') 各主机的超时和重试次数，为 None 时使用 timeout/retries
+# 返回 (array('d') 响应时间ms，无响应为 NO_REPLY, 本片的探测计数)
+def probe_shard(backend, addresses, timeout, retries, workers, timeouts=None, host_retries=None):
+    probe_strategy.set_backend(backend)
+    probe_strategy.reset_counters()
+    ips = [str(ipaddress.IPv4Address(address)) for address in addresses]
+    plan = dict(zip(ips, zip(timeouts, host_retries))) if timeouts is not None else None
+    found = probe_strategy.sweep(ips, timeout=timeout, retries=retries, workers=workers, plan=plan)
+    rtts = array('d', (NO_REPLY if found.get(ip) is None else found[ip] for ip in ips))
+    return rtts, probe_strategy.get_counters()
+
+# 与 probe_strategy.sweep 相同的约定，返回 {ip: 响应时间ms 或 None}，顺序与输入一致
+# workers 为每个子进程内同时在途的探测数上限（仅线程池后端）
+def sweep(ips, timeout=1, retries=2, workers=64, plan=None, shard_size=SCAN_SHARD_SIZE):
+    ips = list(ips)
+    if not ips:
+        return {}
+    pool = get_pool()
+    backend = probe_strategy.detect_backend()
+    # 分片数至少与进程数相同，小网段也能用上所有进程
+    shard_size = max(1, min(shard_size, math.ceil(len(ips) / SCAN_PROCESSES)))
+
+    futures = []
+    for start in range(0, len(ips), shard_size):
+        shard = ips[start:start + shard_size]
+        addresses = array('I', (int(ipaddress.IPv4Address(ip)) for ip in shard))
+        timeouts = host_retries = None
+        if plan:
+            params = [plan.get(ip, (timeout, retries)) for ip in shard]
+            timeouts = array('d', (host_timeout for host_timeout, _ in params))
+            host_retries = array('B', (min(255, host_retries) for _, host_retries in params))
+        futures.append((shard, pool.submit(
+            probe_shard, backend, addresses, timeout, retries, workers, timeouts, host_retries
+        )))
+
+    results = {}
+    for shard, future in futures:
+        rtts, counters = future.result()
+        probe_strategy.add_counters(counters)
+        for ip, rtt in zip(shard, rtts):
+            results[ip] = None if rtt == NO_REPLY else rtt
+    return results
@@ -0,0 +1,156 @@
+import heapq
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from models import Network, get_db_session
+
+logger = logging.getLogger('scan_scheduler')
+
+# 同时扫描的网段数上限
+SCHEDULER_WORKERS = int(os.environ.get('SCHEDULER_WORKERS', 4))
+# 重新读取 networks 表的间隔(秒)，新增/停用/修改扫描间隔无需重启
+SCHEDULER_RELOAD = int(os.environ.get('SCHEDULER_RELOAD', 30))
+
+# 按 Network.scan_interval 为每个启用的网段独立调度扫描
+# 用最小堆保存各网段下次应扫描的时间；上一轮还没扫完的网段本轮跳过
+class NetworkScheduler:
+    def __init__(self, scan_func, default_interval=30, workers=SCHEDULER_WORKERS, reload_interval=SCHEDULER_RELOAD):
+        # scan_func(cidr, schedule_lag) 扫描一个网段
+        self.scan_func = scan_func
+        self.default_interval = default_interval
+        self.reload_interval = reload_interval
+        self.networks = {}  # network_id -> (cidr, 扫描间隔, 加入调度的批次)
+        self.in_flight = set()
+        self.skipped = 0
+        self._heap = []  # (下次扫描时间, network_id, 批次)
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self.workers = max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="NetworkScan")
+        self._next_reload = 0
+
+    # 从数据库同步启用的网段；新网段立即调度，已停用/删除的网段在出堆时丢弃
+    def reload(self):
+        session = get_db_session()
+        try:
+            rows = session.query(Network.id, Network.cidr, Network.scan_interval)\
+                .filter(Network.is_active == True)\
+                .all()
+        finally:
+            session.close()
+
+        now = time.time()
+        with self._lock:
+            current = {}
+            for network_id, cidr, interval in rows:
+                interval = interval if interval and interval > 0 else self.default_interval
+                if network_id in self.networks:
+                    generation = self.networks[network_id][2]
+                else:
+                    # 新加入（或停用后重新启用）的网段换一个批次号，堆里残留的旧条目出堆时会被丢弃
+                    self._generation += 1
+                    generation = self._generation
+                    heapq.heappush(self._heap, (now, network_id, generation))
+                    logger.info(f"加入调度: 网段 {cidr}, 间隔 {interval} 秒")
+                current[network_id] = (cidr, interval, generation)
+            for network_id, (cidr, _, _) in self.networks.items():
+                if network_id not in current:
+                    logger.info(f"移出调度: 网段 {cidr}")
+            self.networks = current
+        self._next_reload = now + self.reload_interval
+
+    def _run(self, network_id, cidr, due):
+        try:
+            # 调度延迟包含在线程池中排队的时间
+            return self.scan_func(cidr, time.time() - due)
+        except Exception as e:
+            logger.error(f"扫描网段 {cidr} 时出错: {str(e)}")
+            return None
+        finally:
+            with self._lock:
+                self.in_flight.discard(network_id)
+
+    # 取出所有到期的网段并提交扫描，返回距离下一个到期时间的秒数
+    def dispatch_due(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, network_id, generation = heapq.heappop(self._heap)
+                entry = self.networks.get(network_id)
+                if entry is None or entry[2] != generation:
+                    continue  # 已停用、删除或重新加入过
+                cidr, interval, _ = entry
+                # 按计划时间推进，避免误差累积；落后超过一个周期时从当前时间重新对齐
+                next_due = due + interval
+                if next_due <= now:
+                    next_due = now + interval
+                heapq.heappush(self._heap, (next_due, network_id, generation))
+
+                if network_id in self.in_flight:
+                    self.skipped += 1
+                    logger.warning(f"网段 {cidr} 上一轮扫描尚未结束，跳过本轮")
+                    continue
+                self.in_flight.add(network_id)
+                self._executor.submit(self._run, network_id, cidr, due)
+
+            wait = self._heap[0][0] - now if self._heap else self.reload_interval
+        return max(0.0, min(wait, self._next_reload - now))
+
+    # 立即扫描所有启用的网段（手动扫描），返回各网段扫描的 Future，结果为 scan_func 的返回值
+    # 正在扫描的网段不重复提交；定时计划不变，与手动扫描重叠的那一轮按上一轮未结束跳过
+    def scan_all(self):
+        self.reload()
+        now = time.time()
+        futures = []
+        with self._lock:
+            for network_id, (cidr, _, _) in self.networks.items():
+                if network_id in self.in_flight:
+                    continue
+                self.in_flight.add(network_id)
+                futures.append(self._executor.submit(self._run, network_id, cidr, now))
+        return futures
+
+    def loop(self):
+        while not self._stopped:
+            try:
+                if time.time() >= self._next_reload:
+                    self.reload()
+                wait = self.dispatch_due()
+            except Exception as e:
+                logger.error(f"调度出错: {str(e)}")
+                wait = min(self.reload_interval, 30)
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
+
+    def start(self):
+        logger.info(f"启动网段调度线程，并发 {self.workers}，每 {self.reload_interval} 秒同步网段配置")
+        threading.Thread(target=self.loop, daemon=True, name="NetworkScheduler").start()
+        return self
+
+    # 立即重新加载网段配置（例如接口修改了 networks 表之后）
+    def refresh(self):
+        self._next_reload = 0
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "networks": len(self.networks),
+                "in_flight": len(self.in_flight),
+                "skipped": self.skipped,
+                "next_due": {
+                    self.networks[network_id][0]: datetime.fromtimestamp(due).strftime("%Y-%m-%d %H:%M:%S")
+                    for due, network_id, generation in self._heap
+                    if network_id in self.networks and self.networks[network_id][2] == generation
+                }
+            }
@@ -0,0 +1,143 @@
+import logging
+from datetime import datetime
+from sqlalchemy import insert, update
+from models import Device, DeviceStatus, DeviceHistory
+import presence_intervals
+import presence_rollups
+
+logger = logging.getLogger('scan_writer')
+
+# IN 查询每批的IP数，低于 SQLite 的绑定变量上限
+CHUNK_SIZE = 500
+
+def _chunks(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+# 一次性加载一批IP对应的设备和状态，返回 {ip: 设备状态行}
+def load_known_devices(session, ips):
+    known = {}
+    for chunk in _chunks(list(ips)):
+        rows = session.query(
+            Device.id.label('device_id'),
+            Device.ip,
+            Device.name,
+            Device.hostname,
+            Device.remark,
+            Device.type,
+            Device.mac_address,
+            DeviceStatus.id.label('status_id'),
+            DeviceStatus.is_online,
+            DeviceStatus.response_time,
+            DeviceStatus.last_seen,
+        ).outerjoin(DeviceStatus, DeviceStatus.device_id == Device.id)\
+            .filter(Device.ip.in_(chunk))\
+            .all()
+        for row in rows:
+            known[row.ip] = row
+    return known
+
+# 把一轮扫描结果 {ip: 响应时间ms 或 None} 写入数据库
+# 先整体加载已知设备，在内存中计算差异，再批量插入/更新；不提交，由调用方在同一事务中提交
+# 传入 changes 列表时，会追加 (事件类型, 数据) 形式的上线/离线/响应时间变化，供提交后推送
+# present 为没有响应时间但已确认在线的IP（邻居表发现），macs 为 {ip: MAC地址}，用于补全 Device.mac_address
+# 返回在线设备数
+def write_scan_results(session, results, now=None, resolve_hostname=None, changes=None, present=None, macs=None):
+    now = now or datetime.now()
+    present = present or ()
+    macs = macs or {}
+    known = load_known_devices(session, results.keys())
+
+    # 1. 新发现的在线设备
+    new_devices = []
+    for ip, response_time in results.items():
+        if (response_time is not None or ip in present) and ip not in known:
+            hostname = resolve_hostname(ip) if resolve_hostname else None
+            new_devices.append({'ip': ip, 'hostname': hostname, 'first_seen': now, 'mac_address': macs.get(ip)})
+    if new_devices:
+        session.execute(insert(Device), new_devices)
+        known.update(load_known_devices(session, [d['ip'] for d in new_devices]))
+
+    # 已知设备的 MAC 地址有变化时更新
+    mac_updates = [
+        {'id': row.device_id, 'mac_address': macs[ip]}
+        for ip, row in known.items() if ip in macs and row.mac_address != macs[ip]
+    ]
+    if mac_updates:
+        session.execute(update(Device), mac_updates)
+
+    # 2. 计算状态变化和历史记录
+    status_inserts = []
+    status_updates = []
+    history_rows = []
+    devices_online = 0
+    rtt_updates = {}
+    now_str = now.strftime("%Y-%m-%d %H:%M:%S")
+
+    for ip, response_time in results.items():
+        row = known.get(ip)
+        online = response_time is not None or ip in present
+        if online:
+            devices_online += 1
+            if row.status_id is None:
+                status_inserts.append({
+                    'device_id': row.device_id, 'is_online': True, 'last_seen': now,
+                    'start_time': now, 'response_time': response_time, 'last_check': now
+                })
+            else:
+                values = {
+                    'id': row.status_id, 'is_online': True, 'last_seen': now,
+                    'response_time': response_time, 'last_check': now
+                }
+                # 如果设备之前离线，现在上线，更新开始时间
+                if not row.is_online:
+                    values['start_time'] = now
+                    logger.info(f"设备上线: {ip} ({row.name or row.hostname or '未知设备'})")
+                status_updates.append(values)
+            if row.status_id is None or not row.is_online:
+                _add_change(changes, 'online', row, {
+                    "last_seen": now_str, "last_check_mins": 0, "duration": "00:00:00",
+                    "start_time": now_str, "response_time": response_time
+                })
+            else:
+                rtt_updates[ip] = {"response_time": response_time, "last_seen": now_str}
+            history_rows.append({'device_id': row.device_id, 'timestamp': now, 'is_online': True, 'response_time': response_time})
+        elif row is not None and row.status_id is not None:
+            # 如果设备之前在线，现在离线，记录日志
+            if row.is_online:
+                logger.info(f"设备离线: {ip} ({row.name or row.hostname or '未知设备'})")
+                _add_change(changes, 'offline', row, {})
+            status_updates.append({'id': row.status_id, 'is_online': False, 'last_check': now})
+            history_rows.append({'device_id': row.device_id, 'timestamp': now, 'is_online': False})
+
+    # 3. 批量写入；按键集合分组，保证每组 executemany 的参数结构一致
+    if status_inserts:
+        session.execute(insert(DeviceStatus), status_inserts)
+    groups = {}
+    for values in status_updates:
+        groups.setdefault(tuple(sorted(values)), []).append(values)
+    for rows in groups.values():
+        session.execute(update(DeviceStatus), rows)
+    if history_rows and presence_intervals.stores_samples():
+        # 离线记录没有 response_time，补齐键以便一次批量插入
+        for values in history_rows:
+            values.setdefault('response_time', None)
+        session.execute(insert(DeviceHistory), history_rows)
+    observations = [(values['device_id'], values['is_online'], values.get('response_time')) for values in history_rows]
+    if observations and presence_intervals.stores_intervals():
+        presence_intervals.record_observations(session, observations, now)
+    if observations:
+        # 按分钟/小时/天累加汇总，长时间段的历史查询直接读汇总表
+        presence_rollups.record_observations(session, observations, now)
+
+    if changes is not None and rtt_updates:
+        changes.append(('rtt', rtt_updates))
+
+    return devices_online
+
+def _add_change(changes, kind, row, extra):
+    if changes is None:
+        return
+    data = {"ip": row.ip, "name": row.name or "", "remark": row.remark or "", "type": row.type or "未分类"}
+    data.update(extra)
+    changes.append((kind, data))
@@ -1,11 +1,21 @@
-import time, threading, json, os, subprocess
-from ping3 import ping
+import time, threading, json, os, tempfile
+import history_log
+import presence_state
+import probe_strategy
+import scan_pool
 
 # 文件路径
 DEVICES_FILE  = "devices.json"
 SESSION_FILE  = "session.json"
 STATUS_FILE   = "status.json"
-HISTORY_FILE  = "history.json"
+HISTORY_FILE  = "history.json"  # 已改为 history_log 按天分段存储，仅用于首次迁移
+
+# 旧版 JSON 文件的维护方式：
+#   snapshot 由数据库扫描结果快照导出（不再单独 ping），默认
+#   scanner  保留旧的独立扫描线程
+#   off      不再维护
+LEGACY_JSON_MODE = os.environ.get("LEGACY_JSON_MODE", "snapshot").strip().lower()
+HISTORY_APPEND_INTERVAL = 60  # 导出模式下历史记录最短追加间隔(秒)，与旧扫描器频率一致
 
 def load_json(path):
     if not os.path.exists(path):
@@ -13,43 +23,42 @@ def load_json(path):
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
+# 先写临时文件再替换，读取方不会看到写了一半的文件
 def save_json(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
-def load_devices():
-    return load_json(DEVICES_FILE)
+_written = {}  # path -> 上次写入的数据
 
-# 尝试通过 ping3 或系统 "ping" 命令判断 IP 是否在线
-def is_online(ip, timeout=1, retries=2):
-    # 尝试使用ping3库
-    for _ in range(retries):
+# 内容没变化时不写文件，返回是否写入
+def save_json_if_changed(path, data):
+    if path not in _written and os.path.exists(path):
         try:
-            result = ping(ip, timeout=timeout)
-            if result is not None and result is not False:
-                return True
+            _written[path] = load_json(path)
         except Exception:
             pass
-    
-    # 如果ping3失败，尝试使用系统ping命令
-    ping_params = []
-    if os.name == 'nt':  # Windows
-        ping_params = ["ping", "-n", "1", "-w", str(int(timeout * 1000)), ip]
-    else:  # Linux/Mac
-        ping_params = ["ping", "-c", "1", "-W", str(timeout), ip]
-    
-    for _ in range(retries):
-        try:
-            res = subprocess.run(
-                ping_params,
-                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-            )
-            if res.returncode == 0:
-                return True
-        except Exception:
-            pass
-    
-    return False
+    if _written.get(path) == data:
+        return False
+    save_json(path, data)
+    _written[path] = data
+    return True
+
+def load_devices():
+    return load_json(DEVICES_FILE)
+
+# 判断 IP 是否在线，探测方式由 probe_strategy 统一选择
+def is_online(ip, timeout=1, retries=2):
+    return probe_strategy.is_online(ip, timeout=timeout, retries=retries)[0]
+
+_presence = presence_state.PresenceTracker()
 
 def check_online_devices():
     now     = time.strftime("%Y-%m-%d %H:%M:%S")
@@ -59,17 +68,13 @@ def check_online_devices():
 
     # 1️⃣ 扫描在线设备
     status = {}
+    results = {}
     scan_errors = []
     
     for ip in devices:
         try:
             # 使用更可靠的检测方法，增加超时和重试
-            if is_online(ip, timeout=1.5, retries=2):
-                status[ip] = {"last_seen": now}
-                # 新上线则记录起始时间
-                if ip not in session:
-                    session[ip] = now
-                    print(f"[INFO] 设备上线: {ip} ({devices.get(ip, {}).get('name', '未知设备')})")
+            results[ip] = True if is_online(ip, timeout=1.5, retries=2) else None
         except Exception as e:
             scan_errors.append(f"{ip}: {str(e)}")
             # 如果检测出错但设备之前是在线的，保持其在线状态
@@ -78,6 +83,21 @@ def check_online_devices():
                 print(f"[WARN] 设备检测失败但保持在线状态: {ip}")
             continue
 
+    # 与数据库扫描器相同的状态机：漏掉探测的在线设备先立即重探测，确认离线前保持原状态
+    states = presence_state.settle(
+        _presence, results, lambda ip: ip in old_status,
+        lambda ips: {ip: True if is_online(ip, timeout=1.5, retries=2) else None for ip in ips}
+    )
+    for ip, state in states.items():
+        if state == presence_state.ONLINE:
+            status[ip] = {"last_seen": now}
+            # 新上线则记录起始时间
+            if ip not in session:
+                session[ip] = now
+                print(f"[INFO] 设备上线: {ip} ({devices.get(ip, {}).get('name', '未知设备')})")
+        elif state == presence_state.SUSPECT and ip in old_status:
+            status[ip] = old_status[ip]
+
     # 记录下线设备
     for ip in old_status:
         if ip not in status and ip in devices:
@@ -102,32 +122,72 @@ def check_online_devices():
     except Exception as e:
         print(f"[ERROR] 保存status文件失败: {e}")
 
-    # 4️⃣ 追加到 history.json
-    try:
-        history = load_json(HISTORY_FILE)
-        # 确保是列表
-        if not isinstance(history, list):
-            history = []
-            
-        # 添加新记录
-        history.append({"timestamp": now, "online": list(status.keys())})
-        
-        # 裁剪历史，保留最近7天的记录
-        now_ts = time.time()
-        cutoff = now_ts - (7 * 24 * 60 * 60)  # 7天前的时间戳
-        
-        history = [entry for entry in history 
-                  if time.mktime(time.strptime(entry["timestamp"], "%Y-%m-%d %H:%M:%S")) >= cutoff]
-        
-        save_json(HISTORY_FILE, history)
-    except Exception as e:
-        print(f"[ERROR] 处理历史记录失败: {e}")
-        
+    # 4️⃣ 追加到历史记录
+    append_history(now, list(status.keys()))
+
     if scan_errors:
         print(f"[WARN] 扫描过程中有{len(scan_errors)}个错误: {', '.join(scan_errors[:3])}{'...' if len(scan_errors) > 3 else ''}")
         
     return status
 
+_last_history_append = 0
+_export_lock = threading.Lock()
+
+# 由数据库状态快照导出旧版 session.json / status.json 和历史记录
+# 只包含 devices.json 中登记的设备，与旧扫描器一致
+def export_snapshot(snapshot):
+    global _last_history_append
+    devices = load_devices()
+    online = snapshot.payload.get("online", {})
+    now = snapshot.payload.get("now") or time.strftime("%Y-%m-%d %H:%M:%S")
+
+    status = {}
+    session = {}
+    for ip in devices:
+        info = online.get(ip)
+        if info:
+            status[ip] = {"last_seen": info["last_seen"], "start_time": info["start_time"]}
+            session[ip] = info["start_time"]
+
+    with _export_lock:
+        save_json_if_changed(SESSION_FILE, session)
+        save_json_if_changed(STATUS_FILE, status)
+
+        if time.time() - _last_history_append >= HISTORY_APPEND_INTERVAL:
+            _last_history_append = time.time()
+            append_history(now, list(status.keys()))
+
+_last_trim_day = None
+
+# 追加一条历史（按天分段的追加式文件，见 history_log），每天裁剪一次，只保留最近7天
+def append_history(now, online_ips):
+    global _last_trim_day
+    try:
+        history_log.append(now, online_ips)
+        
+        today = now[:10]
+        if _last_trim_day != today:
+            _last_trim_day = today
+            history_log.trim(retention_days=7)
+    except Exception as e:
+        print(f"[ERROR] 处理历史记录失败: {e}")
+
+_compat_started = False
+
+# 按 LEGACY_JSON_MODE 维护旧版 JSON 文件；可重复调用，只生效一次
+def start_compat(interval=60):
+    global _compat_started
+    if _compat_started or scan_pool.in_worker():
+        return
+    _compat_started = True
+    
+    if LEGACY_JSON_MODE == "scanner":
+        start_loop(interval=interval)
+    elif LEGACY_JSON_MODE == "snapshot":
+        import presence_snapshot
+        presence_snapshot.subscribe(export_snapshot)
+        print("[INFO] 旧版 JSON 文件由数据库扫描结果导出，不再单独扫描")
+
 def start_loop(interval=30):
     def loop():
         consecutive_errors = 0
@@ -0,0 +1,118 @@
+import logging
+import time
+from sqlalchemy import func, select
+from models import Device, DeviceStatus, Network, ScanLog
+
+logger = logging.getLogger('status_service')
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# 一次连接查询取出所有设备及其状态（只取需要的列，不构造 ORM 对象，也没有逐个懒加载）
+def load_device_rows(session):
+    return session.query(
+        Device.ip,
+        Device.name,
+        Device.remark,
+        Device.type,
+        DeviceStatus.is_online,
+        DeviceStatus.last_seen,
+        DeviceStatus.start_time,
+        DeviceStatus.response_time,
+    ).outerjoin(DeviceStatus, DeviceStatus.device_id == Device.id).all()
+
+# 网段列表，顺带用标量子查询取出最后一次扫描时间
+def load_network_rows(session):
+    last_scan = select(func.max(ScanLog.timestamp)).scalar_subquery()
+    return session.query(Network, last_scan.label('last_update')).all()
+
+def _rate(online, total):
+    return round((online / total) * 100, 1) if total > 0 else 0
+
+def _format_online(row, now_ts):
+    # 计算在线时长
+    last_seen = row.last_seen
+    start_time = row.start_time or last_seen
+
+    delta = int(now_ts - start_time.timestamp())
+    h, rem = divmod(delta, 3600)
+    m, s = divmod(rem, 60)
+
+    return {
+        "name": row.name or "",
+        "remark": row.remark or "",
+        "type": row.type or "未分类",
+        "last_seen": last_seen.strftime(TIME_FORMAT),
+        # 最后一次检测的时间差（分钟）
+        "last_check_mins": int((now_ts - last_seen.timestamp()) / 60),
+        "duration": f"{h:02d}:{m:02d}:{s:02d}",
+        "start_time": start_time.strftime(TIME_FORMAT),
+        "response_time": row.response_time
+    }
+
+# 生成 /api/status 的返回数据：设备明细和按类型统计在同一次遍历中完成
+def build_status(session, now_ts=None):
+    now_ts = now_ts or time.time()
+    now_str = time.strftime(TIME_FORMAT, time.localtime(now_ts))
+
+    online = {}
+    offline = {}
+    type_counts = {}
+
+    for row in load_device_rows(session):
+        ip = row.ip
+        dtype = row.type or "未分类"
+        counts = type_counts.get(dtype)
+        if counts is None:
+            counts = type_counts[dtype] = {"total": 0, "online": 0}
+        counts["total"] += 1
+
+        if row.is_online:
+            counts["online"] += 1
+            try:
+                online[ip] = _format_online(row, now_ts)
+            except Exception as e:
+                logger.error(f"处理设备 {ip} 时间数据出错: {str(e)}")
+                offline[ip] = {"name": row.name or "", "remark": row.remark or "", "type": dtype, "error": "时间数据格式错误"}
+        else:
+            offline[ip] = {"name": row.name or "", "remark": row.remark or "", "type": dtype}
+
+    # 计算每种类型的在线率
+    for counts in type_counts.values():
+        counts["online_rate"] = _rate(counts["online"], counts["total"])
+
+    total = len(online) + len(offline)
+    online_count = sum(counts["online"] for counts in type_counts.values())
+    stats = {
+        "total": total,
+        "online": online_count,
+        "offline": total - online_count,
+        "types": type_counts,
+        "online_rate": _rate(online_count, total)
+    }
+
+    # 添加网段信息
+    network_info = []
+    last_update = None
+    for network, last_scan in load_network_rows(session):
+        last_update = last_scan
+        network_info.append({
+            "id": network.id,
+            "name": network.name,
+            "cidr": network.cidr,
+            "is_active": network.is_active,
+            "scan_interval": network.scan_interval,
+            "last_scan": network.last_scan.strftime(TIME_FORMAT) if network.last_scan else None
+        })
+    if not network_info:
+        # 没有网段时子查询不会随行返回，单独查询
+        last_update = session.query(func.max(ScanLog.timestamp)).scalar()
+
+    return {
+        "online": online,
+        "offline": offline,
+        "stats": stats,
+        "networks": network_info,
+        "now": now_str,
+        "server_time": now_str,
+        "last_update": last_update.strftime(TIME_FORMAT) if last_update else now_str
+    }
@@ -0,0 +1,58 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import neighbor_table  # noqa: E402
+
+IP_NEIGH = """\
+192.168.1.10 dev eth0 lladdr AA:BB:CC:DD:EE:01 REACHABLE
+192.168.1.11 dev eth0 lladdr aa:bb:cc:dd:ee:02 STALE
+192.168.1.12 dev eth0 lladdr aa:bb:cc:dd:ee:03 router DELAY
+192.168.1.13 dev eth0  FAILED
+192.168.1.14 dev eth0 lladdr aa:bb:cc:dd:ee:05 PERMANENT
+10.0.0.1 dev eth1 lladdr aa:bb:cc:dd:ee:06 REACHABLE
+"""
+
+PROC_ARP = """\
+IP address       HW type     Flags       HW address            Mask     Device
+192.168.1.10     0x1         0x2         aa:bb:cc:dd:ee:01     *        eth0
+192.168.1.13     0x1         0x0         00:00:00:00:00:00     *        eth0
+"""
+
+IPS = [f"192.168.1.{i}" for i in range(1, 255)]
+
+
+def write(tmp_path, text):
+    path = tmp_path / "neighbors.txt"
+    path.write_text(text)
+    return str(path)
+
+
+def test_parse_ip_neigh_states():
+    neighbors = neighbor_table.parse_ip_neigh(IP_NEIGH)
+    assert "192.168.1.13" not in neighbors
+    assert neighbors["192.168.1.10"] == ("192.168.1.10", "aa:bb:cc:dd:ee:01", neighbor_table.NUD_REACHABLE)
+    assert neighbors["192.168.1.11"].state == neighbor_table.NUD_STALE
+    assert neighbors["192.168.1.12"].state == neighbor_table.NUD_DELAY
+
+
+def test_discover_marks_only_reachable_hosts_present(tmp_path):
+    path = write(tmp_path, IP_NEIGH)
+    present, macs = neighbor_table.discover(IPS, mode="table", path=path)
+    assert present == {"192.168.1.10": None}
+    assert set(macs) == {"192.168.1.10", "192.168.1.11", "192.168.1.12", "192.168.1.14"}
+    assert macs["192.168.1.11"] == "aa:bb:cc:dd:ee:02"
+
+
+def test_confirm_silent_uses_reachable_entries(tmp_path):
+    path = write(tmp_path, IP_NEIGH)
+    silent = neighbor_table.confirm_silent(["192.168.1.10", "192.168.1.11", "192.168.1.13"], path=path)
+    assert silent == {"192.168.1.10": "aa:bb:cc:dd:ee:01"}
+
+
+def test_proc_arp_entries_are_mac_hints_only(tmp_path):
+    path = write(tmp_path, PROC_ARP)
+    present, macs = neighbor_table.discover(IPS, mode="table", path=path)
+    assert present == {}
+    assert macs == {"192.168.1.10": "aa:bb:cc:dd:ee:01"}
@@ -0,0 +1,6 @@
+# WSGI 入口，例如: gunicorn -w 1 -k gthread --threads 32 wsgi:app
+# 后台扫描/清理线程随入口启动一次；多个 worker 进程会各自启动一套，建议只用一个 worker
+# 需要多线程 worker：每个实时推送连接(/api/stream)占用一个线程，sync worker 会被推送连接阻塞并超时重启
+from app import app, start_background
+
+start_background()